@@ -0,0 +1,77 @@
+"""
+Memory and disk benchmark of the long-format output of the pivoted survey data on SQLite stand-ins with a growing
+question catalogue. For each case, it compares:
+- the size on disk of the wide export ("AllSurveyDataSQL.<format>") and of the long export ("AllSurveyDataLong.<format>"),
+- the memory used by the wide dataframe, by the long dataframe of typed triples and by the sparse wide dataframe.
+The wide data rebuilt from each long export must be identical to the wide data (same CSV file once written back).
+
+Usage:
+    python Benchmarks/bench_compact_output.py [--questions 20 100 400] [--surveys 20] [--users 2000] [--density 0.1]
+"""
+import argparse
+import filecmp
+import os
+import tempfile
+import sys
+from os import path
+
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+from standin_db import create_standin_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, nargs="+", default=[20, 100, 400], help="sizes of the question catalogue")
+    parser.add_argument("--surveys", type=int, default=20)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=0.1, help="share of the questions in each survey")
+    parser.add_argument("--formats", nargs="+", default=["csv", "parquet"], help="output formats to compare")
+    args = parser.parse_args()
+    print("{:>9} {:>8} {:>9} {:>12} {:>12} {:>12} {:>8}".format(
+        "questions", "rows", "triples", "what", "wide (MB)", "long (MB)", "saving"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_questions in args.questions:
+            sqlite_cnxn = create_standin_db(os.path.join(tmp, "survey_{}.db".format(n_questions)),
+                                            n_surveys=args.surveys, n_questions=n_questions, n_users=args.users,
+                                            density=args.density)
+            structure = survey_extractor.get_db_struct(sqlite_cnxn)
+            answer_dtypes = survey_extractor.get_answer_dtypes(structure)
+            long_dtypes = survey_extractor.get_long_dtypes(structure, survey_extractor.fetch_answer_bounds(sqlite_cnxn))
+            query = survey_extractor.compile_AggregateQuery(structure)
+            wide_df = pd.concat(list(survey_extractor.iter_query_chunks(query, sqlite_cnxn)),
+                                ignore_index=True).astype(answer_dtypes)
+            long_df = survey_extractor.wide_to_long(wide_df, long_dtypes)
+            sparse_df = survey_extractor.long_to_wide(long_df, answer_dtypes, sparse=True)
+            sizes = []
+            # Memory of the dataframes (the sparse frame is compared with the wide one in place of the long one)
+            wide_memory = wide_df.memory_usage(deep=True).sum() / 1e6
+            sizes.append(("memory", wide_memory, long_df.memory_usage(deep=True).sum() / 1e6))
+            sizes.append(("memory sparse", wide_memory, sparse_df.memory_usage(deep=True).sum() / 1e6))
+            # Size of the exported files, and check of the wide data rebuilt from the long export
+            wide_filepath = os.path.join(tmp, "AllSurveyDataSQL.csv")
+            survey_extractor.export_survey_data([wide_df], answer_dtypes, wide_filepath, "csv")
+            for output_format in args.formats:
+                extension = survey_extractor.OUTPUT_FORMATS[output_format]
+                wide_format_filepath = os.path.join(tmp, "AllSurveyDataSQL" + extension)
+                long_filepath = os.path.join(tmp, "AllSurveyDataLong" + extension)
+                survey_extractor.export_survey_data([wide_df], answer_dtypes, wide_format_filepath, output_format)
+                survey_extractor.export_survey_data([long_df], long_dtypes, long_filepath, output_format)
+                survey_extractor.write_long_columns(long_filepath, answer_dtypes)
+                sizes.append(("disk " + output_format, path.getsize(wide_format_filepath) / 1e6,
+                              path.getsize(long_filepath) / 1e6))
+                rebuilt_filepath = os.path.join(tmp, "rebuilt.csv")
+                survey_extractor.read_survey_data_long(long_filepath, output_format).to_csv(rebuilt_filepath)
+                assert filecmp.cmp(wide_filepath, rebuilt_filepath, shallow=False), \
+                    "the wide data rebuilt from the {} long export differs".format(output_format)
+            for what, wide_size, long_size in sizes:
+                print("{:>9} {:>8} {:>9} {:>12} {:>12.3f} {:>12.3f} {:>7.0%}".format(
+                    n_questions, len(wide_df), len(long_df), what, wide_size, long_size, 1 - long_size / wide_size))
+            sqlite_cnxn.close()
+    print("[OK] The wide data rebuilt from the long exports is identical to the wide data.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Memory benchmark of the export of the pivoted survey data on SQLite stand-ins with a growing number of users.
+It compares the peak memory (measured with tracemalloc) of:
+- "legacy": "pd.read_sql()" of the whole final query into one dataframe, then "df.to_csv()",
+- "stream": the final query read and appended to the file chunk by chunk with "export_survey_data()",
+- "client": the client-side pivot of the "Answer" table written chunk by chunk with "export_survey_data()".
+The streamed exports must be identical to the legacy one.
+
+Usage:
+    python Benchmarks/bench_export_memory.py [--users 2000 8000 32000] [--chunksize 5000] [--format csv]
+"""
+import argparse
+import filecmp
+import os
+import tempfile
+import sys
+import time
+import tracemalloc
+from os import path
+
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+from standin_db import create_standin_db
+
+
+def measure(function, *args):
+    """
+    This function runs "function(*args)" and returns its duration in seconds and its peak of traced memory in MB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[2000, 8000, 32000], help="numbers of users")
+    parser.add_argument("--surveys", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--chunksize", type=int, default=5000)
+    parser.add_argument("--format", default="csv", help="output format of the streamed exports")
+    args = parser.parse_args()
+    extension = survey_extractor.OUTPUT_FORMATS[args.format]
+    print("{:>8} {:>9} {:>9} {:>14} {:>14}".format("users", "rows", "method", "time (s)", "peak (MB)"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_users in args.users:
+            sqlite_cnxn = create_standin_db(os.path.join(tmp, "survey_{}.db".format(n_users)), n_surveys=args.surveys,
+                                            n_questions=args.questions, n_users=n_users, density=0.3)
+            structure = survey_extractor.get_db_struct(sqlite_cnxn)
+            answer_dtypes = survey_extractor.get_answer_dtypes(structure)
+            query = survey_extractor.compile_AggregateQuery(structure)
+            legacy_filepath = os.path.join(tmp, "legacy.csv")
+
+            def legacy_export():
+                df = pd.read_sql("SELECT * FROM (" + query + ") as t ORDER BY SurveyId, UserId", sqlite_cnxn)
+                df.to_csv(legacy_filepath)
+
+            methods = {
+                "legacy": legacy_export,
+                "stream": lambda: survey_extractor.export_survey_data(
+                    survey_extractor.iter_query_chunks(query, sqlite_cnxn, args.chunksize), answer_dtypes,
+                    os.path.join(tmp, "stream" + extension), args.format),
+                "client": lambda: survey_extractor.export_survey_data(
+                    survey_extractor.extract_pivot_client_side(sqlite_cnxn, structure, args.chunksize), answer_dtypes,
+                    os.path.join(tmp, "client" + extension), args.format),
+            }
+            for method, function in methods.items():
+                duration, peak = measure(function)
+                print("{:>8} {:>9} {:>9} {:>14.3f} {:>14.1f}".format(
+                    n_users, len(pd.read_csv(legacy_filepath, usecols=[0])), method, duration, peak))
+            if args.format == "csv":
+                for method in ("stream", "client"):
+                    assert filecmp.cmp(legacy_filepath, os.path.join(tmp, method + ".csv"), shallow=False), \
+                        "the {} export differs from the legacy export".format(method)
+            sqlite_cnxn.close()
+
+
+if __name__ == "__main__":
+    main()
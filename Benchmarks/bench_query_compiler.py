@@ -0,0 +1,86 @@
+"""
+Microbenchmark of the query compiler: "compile_FinalQuery()" against the legacy "set_FinalQuery_legacy()" loops.
+It builds synthetic survey structures of growing size, times the compilation and checks that both versions emit
+the same SQL text wherever the legacy version is still fast enough to be run.
+
+Usage:
+    python Benchmarks/bench_query_compiler.py [--full] [--density 0.1]
+The "--full" flag adds the 10k surveys x 1k questions case (about 10 million structure rows).
+"""
+import argparse
+import io
+import os
+import tempfile
+import sys
+import time
+from contextlib import redirect_stdout
+from os import path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+
+
+SIZES = [(10, 10), (30, 30), (100, 100), (1000, 100), (1000, 1000)]
+FULL_SIZES = SIZES + [(10000, 1000)]
+# The legacy compiler is O(S.Q.N): only run it on the structures with at most this many (survey, question) cells
+LEGACY_MAX_CELLS = 2500
+
+
+def make_structure(n_surveys, n_questions, density, seed=0):
+    """
+    This function builds a synthetic survey structure dataframe, in the format returned by "get_db_struct()",
+    where each question belongs to each survey with the probability "density".
+    """
+    rng = np.random.default_rng(seed)
+    survey_ids = np.arange(1, n_surveys + 1, dtype=np.int64)
+    question_ids = np.arange(1, n_questions + 1, dtype=np.int64)
+    return pd.DataFrame({"SurveyId": np.repeat(survey_ids, n_questions),
+                         "QuestionId": np.tile(question_ids, n_surveys),
+                         "QuestionInSurvey": (rng.random(n_surveys * n_questions) < density).astype(np.int64)})
+
+
+def run_legacy(structure):
+    """
+    This function runs the legacy query builder in a temporary directory (it writes "./outputs/saved_query.txt")
+    and returns the query text it saved.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            # Silence the previews printed by "write_query()"
+            with redirect_stdout(io.StringIO()):
+                survey_extractor.set_FinalQuery_legacy(structure)
+            return survey_extractor.read_query("./outputs/saved_query.txt")
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="include the 10k surveys x 1k questions case")
+    parser.add_argument("--density", type=float, default=0.1, help="share of the questions in each survey")
+    args = parser.parse_args()
+    print("{:>8} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "surveys", "questions", "cells", "new (s)", "legacy (s)", "query (MB)"))
+    for n_surveys, n_questions in (FULL_SIZES if args.full else SIZES):
+        structure = make_structure(n_surveys, n_questions, args.density)
+        start = time.perf_counter()
+        query = survey_extractor.compile_FinalQuery(structure)
+        new_time = time.perf_counter() - start
+        legacy_time = float("nan")
+        if n_surveys * n_questions <= LEGACY_MAX_CELLS:
+            start = time.perf_counter()
+            legacy_query = run_legacy(structure)
+            legacy_time = time.perf_counter() - start
+            assert legacy_query == query, "compile_FinalQuery() differs from the legacy query"
+        print("{:>8} {:>8} {:>12} {:>12.4f} {:>12.4f} {:>12.1f}".format(
+            n_surveys, n_questions, n_surveys * n_questions, new_time, legacy_time, len(query) / 1e6))
+        del query
+
+
+if __name__ == "__main__":
+    main()
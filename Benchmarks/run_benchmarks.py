@@ -0,0 +1,220 @@
+"""
+End-to-end benchmark suite of the extraction pipeline on synthetic SQLite stand-ins (see "standin_db.py").
+For each case, it times every stage of the pipeline and records its peak of traced memory and its row throughput:
+- "generate": creation of the synthetic database,
+- "get_db_struct" and "get_db_struct_legacy": fetch of the survey structure,
+- "compile_union", "compile_aggregate" and "compile_legacy": compilation of the final query,
+- "extract_<path>": run of the extraction path (final query in "union" or "aggregate" mode, client-side pivot or parallel
+  batches) with its rows fetched chunk by chunk and discarded,
+- "export_reference" and "export_<path>": extraction and export of the survey data to a CSV file.
+The reference ("legacy") stages are only run on the structures small enough for them (see "LEGACY_MAX_CELLS").
+Each optimized path is checked against its reference: same structure dataframe, same query text and CSV files identical
+to the reference export ("pd.read_sql()" of the union query and "df.to_csv()", like the original script).
+
+The results of the run are appended to a JSON file (one entry per run, with the git revision and the package versions)
+so that the runs of two versions of the code can be compared.
+
+Usage:
+    python Benchmarks/run_benchmarks.py [--case 20 20 5000 0.3 ...] [--answer-rate 0.5] [--no-memory] [--output file.json]
+"""
+import argparse
+import filecmp
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from os import path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+from standin_db import create_standin_db
+
+# (surveys, questions, users, structure density) of the default cases
+CASES = [(3, 4, 1000, 0.5), (20, 20, 2000, 0.3), (40, 80, 2000, 0.1)]
+# The legacy functions are O(S.Q) queries or O(S.Q.N) loops: only run them up to this many (survey, question) cells
+LEGACY_MAX_CELLS = 2500
+RESULTS_FILEPATH = path.join(path.dirname(path.abspath(__file__)), "results", "benchmark_results.json")
+
+
+def measure(stage_results, stage, trace_memory, function, *args):
+    """
+    This function runs "function(*args)" and stores its duration in seconds and its peak of traced memory in MB (None if
+    "trace_memory" is False) in "stage_results[stage]". If the function returns a number of rows, the number of rows and
+    the throughput in rows per second are stored too.
+    It returns the value returned by the function.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = function(*args)
+    duration = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = round(tracemalloc.get_traced_memory()[1] / 1e6, 3)
+        tracemalloc.stop()
+    stage_results[stage] = {"time_s": round(duration, 6), "peak_mb": peak}
+    if isinstance(value, int):
+        stage_results[stage]["rows"] = value
+        stage_results[stage]["rows_per_s"] = round(value / duration, 1) if duration else None
+    return value
+
+
+def count_rows(chunks):
+    """
+    This function consumes an iterator of dataframes without keeping them and returns their total number of rows.
+    """
+    return sum(len(df) for df in chunks)
+
+
+def run_legacy_query(structure):
+    """
+    This function runs the legacy query builder in a temporary directory (it writes "./outputs/saved_query.txt")
+    and returns the query text it saved.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            # Silence the previews printed by "write_query()"
+            with redirect_stdout(io.StringIO()):
+                survey_extractor.set_FinalQuery_legacy(structure)
+            return survey_extractor.read_query("./outputs/saved_query.txt")
+        finally:
+            os.chdir(cwd)
+
+
+def get_git_revision():
+    """
+    This function returns the current git revision of the repository, or None if it cannot be found.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=path.dirname(path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(case_id, n_surveys, n_questions, n_users, density, args, tmp):
+    """
+    This function generates the stand-in database of a case, runs and checks all the stages of the pipeline on it.
+    It returns the results of the case as a dictionary.
+    """
+    stages = {}
+    checks = {}
+    db_path = os.path.join(tmp, "standin_{}.db".format(case_id))
+    # The stand-in is a file so that the workers of the parallel extraction can open their own connections to it
+    sqlite_cnxn = measure(stages, "generate", False, create_standin_db, db_path, n_surveys, n_questions, n_users,
+                          density, args.participation, args.answer_rate, args.null_rate, case_id)
+    nb_answers = sqlite_cnxn.execute("SELECT COUNT(*) FROM Answer").fetchone()[0]
+    with_legacy = n_surveys * n_questions <= LEGACY_MAX_CELLS
+    # Structure of the surveys
+    structure = measure(stages, "get_db_struct", args.memory, survey_extractor.get_db_struct, sqlite_cnxn)
+    if with_legacy:
+        legacy_structure = measure(stages, "get_db_struct_legacy", args.memory, survey_extractor.get_db_struct_legacy,
+                                   sqlite_cnxn)
+        checks["get_db_struct"] = bool(legacy_structure.astype(np.int64).equals(structure))
+    answer_dtypes = survey_extractor.get_answer_dtypes(structure)
+    # Compilation of the final query
+    queries = {}
+    for query_mode, compiler in survey_extractor.QUERY_COMPILERS.items():
+        queries[query_mode] = measure(stages, "compile_" + query_mode, args.memory, compiler, structure)
+    if with_legacy:
+        legacy_query = measure(stages, "compile_legacy", args.memory, run_legacy_query, structure)
+        checks["compile_union"] = legacy_query == queries["union"]
+    manager = survey_extractor.ConnectionManager("sqlite3", (db_path,))
+    # Extraction paths, each one returning the pivoted survey data chunk by chunk
+    extraction_paths = {
+        "union": lambda: survey_extractor.iter_query_chunks(queries["union"], sqlite_cnxn, args.chunksize),
+        "aggregate": lambda: survey_extractor.iter_query_chunks(queries["aggregate"], sqlite_cnxn, args.chunksize),
+        "client": lambda: survey_extractor.extract_pivot_client_side(sqlite_cnxn, structure, args.chunksize),
+        "parallel": lambda: survey_extractor.extract_batches_parallel(manager, structure, "aggregate", args.workers,
+                                                                      chunksize=args.chunksize),
+    }
+    for extraction_path, chunks in extraction_paths.items():
+        measure(stages, "extract_" + extraction_path, args.memory, lambda: count_rows(chunks()))
+    # Export of the survey data: the reference export reads the whole result of the union query in one dataframe
+    reference_filepath = os.path.join(tmp, "reference_{}.csv".format(case_id))
+
+    def reference_export():
+        df = pd.read_sql("SELECT * FROM (" + queries["union"] + ") as t ORDER BY SurveyId, UserId", sqlite_cnxn)
+        df.to_csv(reference_filepath)
+        return len(df)
+
+    measure(stages, "export_reference", args.memory, reference_export)
+    for extraction_path, chunks in extraction_paths.items():
+        export_filepath = os.path.join(tmp, "{}_{}.csv".format(extraction_path, case_id))
+        measure(stages, "export_" + extraction_path, args.memory,
+                lambda: survey_extractor.export_survey_data(chunks(), answer_dtypes, export_filepath, "csv"))
+        checks["export_" + extraction_path] = filecmp.cmp(reference_filepath, export_filepath, shallow=False)
+        os.remove(export_filepath)
+    os.remove(reference_filepath)
+    manager.close_all()
+    sqlite_cnxn.close()
+    return {"surveys": n_surveys, "questions": n_questions, "users": n_users, "density": density,
+            "answers": nb_answers, "stages": stages, "checks": checks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--case", type=float, nargs=4, action="append", metavar=("SURVEYS", "QUESTIONS", "USERS", "DENSITY"),
+                        help="case to run (repeat the option for several cases), instead of the default cases")
+    parser.add_argument("--participation", type=float, default=0.3, help="share of the users answering each survey")
+    parser.add_argument("--answer-rate", type=float, default=0.5,
+                        help="share of the questions of a survey answered by each participant")
+    parser.add_argument("--null-rate", type=float, default=0.01, help="share of the answers with a NULL value")
+    parser.add_argument("--chunksize", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4, help="number of workers of the parallel extraction")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="do not trace the memory (tracemalloc slows the stages down)")
+    parser.add_argument("--output", default=RESULTS_FILEPATH, help="JSON file the results of the run are appended to")
+    args = parser.parse_args()
+    cases = [(int(s), int(q), int(u), d) for s, q, u, d in args.case] if args.case else CASES
+    run = {"date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "revision": get_git_revision(),
+           "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+           "parameters": {"participation": args.participation, "answer_rate": args.answer_rate,
+                          "null_rate": args.null_rate, "chunksize": args.chunksize, "workers": args.workers,
+                          "memory": args.memory},
+           "cases": []}
+    print("{:>8} {:>9} {:>8} {:>9} {:>22} {:>10} {:>10} {:>12}".format(
+        "surveys", "questions", "users", "answers", "stage", "time (s)", "peak (MB)", "rows/s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for case_id, (n_surveys, n_questions, n_users, density) in enumerate(cases):
+            case = run_case(case_id, n_surveys, n_questions, n_users, density, args, tmp)
+            run["cases"].append(case)
+            for stage, result in case["stages"].items():
+                print("{:>8} {:>9} {:>8} {:>9} {:>22} {:>10.4f} {:>10} {:>12}".format(
+                    n_surveys, n_questions, n_users, case["answers"], stage, result["time_s"],
+                    "-" if result["peak_mb"] is None else "{:.1f}".format(result["peak_mb"]),
+                    "{:.0f}".format(result["rows_per_s"]) if result.get("rows_per_s") else "-"))
+    # Append the run to the results of the previous runs
+    runs = []
+    if path.exists(args.output):
+        with open(args.output) as results_file:
+            runs = json.load(results_file)
+    elif path.dirname(args.output):
+        os.makedirs(path.dirname(args.output), exist_ok=True)
+    runs.append(run)
+    with open(args.output, "w") as results_file:
+        json.dump(runs, results_file, indent=2)
+    print("\n[SAVE] The results have been appended to {}.".format(args.output))
+    failed = ["{} (case {})".format(check, case_id) for case_id, case in enumerate(run["cases"])
+              for check, passed in case["checks"].items() if not passed]
+    if failed:
+        print("[FAIL] Output different from the reference implementation: " + ", ".join(failed))
+        return 1
+    print("[OK] All the optimized paths return the same output as the reference implementations.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
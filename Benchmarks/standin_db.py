@@ -0,0 +1,105 @@
+"""
+Local SQLite stand-in for the survey database (Survey, Question, SurveyStructure, User and Answer tables).
+It generates synthetic data so that the queries compiled by the "survey_extractor" package can be run and compared
+without access to the SQL Server instance.
+
+Usage:
+    python Benchmarks/standin_db.py survey.db [--surveys 3] [--questions 4] [--users 1000] [--density 0.5] [...]
+The generated database can then be extracted with "python SE-SQL_script.py --backend sqlite3 --database survey.db".
+"""
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE Survey (SurveyId INTEGER PRIMARY KEY, SurveyDescription TEXT);
+CREATE TABLE Question (QuestionId INTEGER PRIMARY KEY, Question_Text TEXT);
+CREATE TABLE SurveyStructure (SurveyId INTEGER NOT NULL REFERENCES Survey (SurveyId),
+                              QuestionId INTEGER NOT NULL REFERENCES Question (QuestionId),
+                              OrdinalValue INTEGER,
+                              PRIMARY KEY (SurveyId, QuestionId));
+CREATE TABLE [User] (UserId INTEGER PRIMARY KEY, User_Name TEXT);
+CREATE TABLE Answer (QuestionId INTEGER NOT NULL REFERENCES Question (QuestionId),
+                     SurveyId INTEGER NOT NULL REFERENCES Survey (SurveyId),
+                     UserId INTEGER NOT NULL REFERENCES [User] (UserId),
+                     Answer_Value INTEGER,
+                     PRIMARY KEY (UserId, SurveyId, QuestionId));
+"""
+
+
+def create_standin_db(db_path=":memory:", n_surveys=3, n_questions=4, n_users=1000, density=0.5,
+                      participation=0.3, answer_rate=0.5, null_rate=0.01, seed=0):
+    """
+    This function creates a SQLite stand-in database at "db_path" and fills it with synthetic survey data:
+    - "density": probability that a question belongs to a survey structure,
+    - "participation": probability that a user answers a survey,
+    - "answer_rate": probability that a participant answers each question of the survey,
+    - "null_rate": probability that a stored answer has a NULL "Answer_Value".
+    A participant who answered none of the questions of the survey gets a single answer to a random question,
+    which may be out of the survey structure (like the answers of survey 3 in the sample data).
+    It returns the open "sqlite3" connection.
+    """
+    rng = np.random.default_rng(seed)
+    sqlite_cnxn = sqlite3.connect(db_path, check_same_thread=False)
+    sqlite_cnxn.executescript(SCHEMA)
+    survey_ids = np.arange(1, n_surveys + 1)
+    question_ids = np.arange(1, n_questions + 1)
+    user_ids = np.sort(rng.choice(np.arange(1, 20 * n_users + 1), size=n_users, replace=False))
+    sqlite_cnxn.executemany("INSERT INTO Survey VALUES (?, ?)",
+                            [(int(s), "Survey {}".format(s)) for s in survey_ids])
+    sqlite_cnxn.executemany("INSERT INTO Question VALUES (?, ?)",
+                            [(int(q), "Question {}".format(q)) for q in question_ids])
+    sqlite_cnxn.executemany("INSERT INTO [User] VALUES (?, ?)",
+                            [(int(u), "User {}".format(u)) for u in user_ids])
+    for survey_id in survey_ids:
+        # Survey structure of the current survey
+        survey_questions = question_ids[rng.random(n_questions) < density]
+        sqlite_cnxn.executemany("INSERT INTO SurveyStructure VALUES (?, ?, ?)",
+                                [(int(survey_id), int(q), rank) for rank, q in enumerate(survey_questions, 1)])
+        # Participants of the current survey and their answers to the questions of the survey
+        participants = user_ids[rng.random(n_users) < participation]
+        answered = rng.random((len(participants), len(survey_questions))) < answer_rate
+        user_pos, question_pos = np.nonzero(answered)
+        answer_users = participants[user_pos]
+        answer_questions = survey_questions[question_pos]
+        # Participants without any answer get one answer to a random question of the catalogue
+        silent = participants[~answered.any(axis=1)]
+        answer_users = np.concatenate([answer_users, silent])
+        answer_questions = np.concatenate([answer_questions, rng.choice(question_ids, size=len(silent))])
+        answer_values = rng.integers(0, 10, size=len(answer_users))
+        null_values = rng.random(len(answer_users)) < null_rate
+        sqlite_cnxn.executemany("INSERT INTO Answer VALUES (?, ?, ?, ?)",
+                                [(int(q), int(survey_id), int(u), None if is_null else int(v))
+                                 for q, u, v, is_null in zip(answer_questions, answer_users, answer_values,
+                                                             null_values)])
+    sqlite_cnxn.commit()
+    return sqlite_cnxn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path", help="path of the SQLite database to create (replaced if it exists)")
+    parser.add_argument("--surveys", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--density", type=float, default=0.5, help="share of the questions in each survey")
+    parser.add_argument("--participation", type=float, default=0.3, help="share of the users answering each survey")
+    parser.add_argument("--answer-rate", type=float, default=0.5,
+                        help="share of the questions of a survey answered by each participant")
+    parser.add_argument("--null-rate", type=float, default=0.01, help="share of the answers with a NULL value")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if os.path.exists(args.db_path):
+        os.remove(args.db_path)
+    sqlite_cnxn = create_standin_db(args.db_path, args.surveys, args.questions, args.users, args.density,
+                                    args.participation, args.answer_rate, args.null_rate, args.seed)
+    nb_answers = sqlite_cnxn.execute("SELECT COUNT(*) FROM Answer").fetchone()[0]
+    sqlite_cnxn.close()
+    print("[OK] {} surveys, {} questions, {} users and {} answers saved to {}.".format(
+        args.surveys, args.questions, args.users, nb_answers, args.db_path))
+
+
+if __name__ == "__main__":
+    main()
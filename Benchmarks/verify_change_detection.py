@@ -0,0 +1,202 @@
+"""
+Checks the detection of the changes of the survey database on a SQLite stand-in: the incremental refresh
+("refresh_survey_data_incremental()") is run after each scenario of changes (updates, insertions and deletions of
+answers, changes of the survey structure) and must re-query the expected number of surveys and export the same file as
+the legacy export ("pd.read_sql()" of the union query and "df.to_csv()").
+The scenarios include changes of several answers which cancel each other out in a weighted sum of the answers.
+It also checks that the query cache of "check_view()" recognizes an unchanged survey structure from its server-side
+fingerprint, compiles the final query again when the structure changes without changing the counts and the sums of the
+keys of its tables, and saves the current structure and query in the outputs folder. It finally checks that the change
+fingerprint polled by the watch mode ("fetch_change_fingerprint()") changes with each of these changes.
+
+Usage:
+    python Benchmarks/verify_change_detection.py
+"""
+import filecmp
+import io
+import os
+import tempfile
+import sys
+from contextlib import redirect_stdout
+from os import path
+
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+from standin_db import create_standin_db
+
+# Survey and question of the answers changed by the scenarios (the question is in the structure of the survey)
+SURVEY_ID = 2
+QUESTION_ID = 3
+# Users answering the question in the collision scenario
+COLLISION_USERS = (1, 2, 3)
+
+
+def set_answers(sqlite_cnxn, values):
+    """
+    This function sets the answers of the users of "COLLISION_USERS" to the question "QUESTION_ID" of the survey
+    "SURVEY_ID" to the given values, creating the users and the answers if needed.
+    """
+    for user_id, value in zip(COLLISION_USERS, values):
+        sqlite_cnxn.execute("INSERT OR IGNORE INTO [User] VALUES (?, ?)", (user_id, "User {}".format(user_id)))
+        sqlite_cnxn.execute("INSERT OR REPLACE INTO Answer VALUES (?, ?, ?, ?)", (QUESTION_ID, SURVEY_ID, user_id, value))
+
+
+# Scenarios run one after the other: (description, SQL statements or function of the connection, number of surveys
+# the incremental refresh must re-query, or None for a full export)
+SCENARIOS = [
+    ("first export", [], None),
+    ("no change", [], 0),
+    ("answers 3, 5, 2 of three users", lambda sqlite_cnxn: set_answers(sqlite_cnxn, (3, 5, 2)), 1),
+    # Same number of answers and same maximum user id, and the same weighted sum of the (user, question, value) triples
+    ("answers changed to 4, 3, 3 (collision of a weighted sum)", lambda sqlite_cnxn: set_answers(sqlite_cnxn, (4, 3, 3)), 1),
+    ("answer set to NULL", ["UPDATE Answer SET Answer_Value = NULL WHERE SurveyId = 2 AND UserId = 1"], 1),
+    ("answer deleted", ["DELETE FROM Answer WHERE SurveyId = 2 AND UserId = 2"], 1),
+    ("new respondent", ["INSERT INTO [User] VALUES (5, 'User 5')",
+                        "INSERT INTO Answer VALUES ({}, 1, 5, 1)".format(QUESTION_ID)], 1),
+    ("user deleted (its answers are kept)", ["DELETE FROM [User] WHERE UserId = 5"], 1),
+    ("answers of the deleted user deleted", ["DELETE FROM Answer WHERE UserId = 5"], 0),
+    ("all the answers of a survey deleted", ["DELETE FROM Answer WHERE SurveyId = 3"], 1),
+    ("question removed from a survey", ["DELETE FROM SurveyStructure WHERE SurveyId = 1 AND QuestionId = 2"], 1),
+    ("question added to a survey", ["INSERT INTO SurveyStructure VALUES (1, 2, 99)"], 1),
+    ("new question", ["INSERT INTO Question VALUES (7, 'Question 7')",
+                      "INSERT INTO SurveyStructure VALUES (4, 7, 99)"], None),
+    ("survey deleted", ["DELETE FROM Answer WHERE SurveyId = 4", "DELETE FROM SurveyStructure WHERE SurveyId = 4",
+                        "DELETE FROM Survey WHERE SurveyId = 4"], 0),
+]
+
+
+def export_reference(sqlite_cnxn, structure, reference_filepath):
+    """
+    This function exports the survey data of the stand-in database like the original script.
+    """
+    query = survey_extractor.compile_FinalQuery(structure)
+    pd.read_sql("SELECT * FROM (" + query + ") as t ORDER BY SurveyId, UserId", sqlite_cnxn).to_csv(reference_filepath)
+
+
+def check_query_cache(tmp):
+    """
+    This function runs "check_view()" on a stand-in database before and after changes of its survey structure, and
+    checks the outcome of the query cache, and that the returned query and the files saved in the outputs folder are the
+    ones of the current structure.
+    """
+    sqlite_cnxn = create_standin_db(os.path.join(tmp, "structure.db"), n_surveys=4, n_questions=6, n_users=100, seed=8)
+    # The survey 1 has the questions 2, 3 and 4, and not the questions 1 and 5
+    sqlite_cnxn.execute("DELETE FROM SurveyStructure WHERE SurveyId = 1")
+    sqlite_cnxn.executemany("INSERT INTO SurveyStructure VALUES (1, ?, ?)", [(2, 1), (3, 2), (4, 3)])
+    sqlite_cnxn.commit()
+    # Scenarios run one after the other: (description, SQL statements, expected outcome of the query cache)
+    scenarios = [
+        ("first check", [], "miss"),
+        ("no change", [], "hit"),
+        # Same row counts, same sums of the keys and of their products
+        ("questions 2 and 4 of a survey replaced by 1 and 5",
+         ["DELETE FROM SurveyStructure WHERE SurveyId = 1 AND QuestionId IN (2, 4)",
+          "INSERT INTO SurveyStructure VALUES (1, 1, 4)", "INSERT INTO SurveyStructure VALUES (1, 5, 5)"], "miss"),
+        ("questions 1 and 5 replaced back by 2 and 4",
+         ["DELETE FROM SurveyStructure WHERE SurveyId = 1 AND QuestionId IN (1, 5)",
+          "INSERT INTO SurveyStructure VALUES (1, 2, 1)", "INSERT INTO SurveyStructure VALUES (1, 4, 3)"], "hit"),
+    ]
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        for description, statements, expected in scenarios:
+            for statement in statements:
+                sqlite_cnxn.execute(statement)
+            sqlite_cnxn.commit()
+            stage_records = []
+            # Silence the banners of "check_view()"
+            with redirect_stdout(io.StringIO()), \
+                    survey_extractor.use_metrics_recorder(survey_extractor.MetricsRecorder(callback=stage_records.append)):
+                query = survey_extractor.check_view(sqlite_cnxn)[0]
+            outcome = [stage_record["cache"] for stage_record in stage_records if stage_record["stage"] == "check_view"][0]
+            assert outcome == expected, "{}: cache {} instead of {}".format(description, outcome, expected)
+            structure = survey_extractor.get_db_struct(sqlite_cnxn)
+            assert query == survey_extractor.compile_FinalQuery(structure), \
+                "{}: the query of the cache is not the one of the current structure".format(description)
+            # The files of the outputs folder must hold the current structure and its query, even on a hit of an older
+            # entry of the cache
+            assert survey_extractor.read_query("./outputs/saved_query.txt") == query, \
+                "{}: the saved query is not the one of the current structure".format(description)
+            assert pd.read_csv("./outputs/updated_survey_structure.csv", index_col=0).equals(structure), \
+                "{}: the saved structure is not the current structure".format(description)
+            print("[query cache] {:<60} {:>4}".format(description, outcome))
+    finally:
+        os.chdir(cwd)
+    sqlite_cnxn.close()
+
+
+def check_change_fingerprint(tmp):
+    """
+    This function computes the change fingerprint of the watch mode before and after changes of a stand-in database which
+    cancel each other out in weighted sums, and checks which parts of the fingerprint have changed.
+    """
+    sqlite_cnxn = create_standin_db(os.path.join(tmp, "watch.db"), n_surveys=4, n_questions=6, n_users=100, seed=9)
+    sqlite_cnxn.execute("DELETE FROM SurveyStructure WHERE SurveyId = 1")
+    sqlite_cnxn.executemany("INSERT INTO SurveyStructure VALUES (1, ?, ?)", [(2, 1), (4, 2)])
+    set_answers(sqlite_cnxn, (3, 5, 2))
+    sqlite_cnxn.commit()
+    nb_structure_parts = len(survey_extractor.STRUCTURE_FINGERPRINT_PARTS)
+    # Scenarios run one after the other: (description, changes, whether the structure and the data parts change)
+    scenarios = [
+        ("answers changed from 3, 5, 2 to 4, 3, 3", lambda sqlite_cnxn: set_answers(sqlite_cnxn, (4, 3, 3)), (False, True)),
+        ("questions 2 and 4 of a survey replaced by 1 and 5",
+         lambda sqlite_cnxn: sqlite_cnxn.executescript("DELETE FROM SurveyStructure WHERE SurveyId = 1; "
+                                                       + "INSERT INTO SurveyStructure VALUES (1, 1, 1), (1, 5, 2);"),
+         (True, False)),
+    ]
+    fingerprint = survey_extractor.fetch_change_fingerprint(sqlite_cnxn)
+    for description, changes, expected in scenarios:
+        changes(sqlite_cnxn)
+        sqlite_cnxn.commit()
+        new_fingerprint = survey_extractor.fetch_change_fingerprint(sqlite_cnxn)
+        changed = (new_fingerprint[:nb_structure_parts] != fingerprint[:nb_structure_parts],
+                   new_fingerprint[nb_structure_parts:] != fingerprint[nb_structure_parts:])
+        assert changed == expected, "{}: (structure, data) changed {} instead of {}".format(description, changed, expected)
+        print("[watch] {:<66} structure {}, data {}".format(description, *["changed" if part else "unchanged"
+                                                                            for part in changed]))
+        fingerprint = new_fingerprint
+    sqlite_cnxn.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_cnxn = create_standin_db(os.path.join(tmp, "standin.db"), n_surveys=5, n_questions=6, n_users=300,
+                                        density=0.7, participation=0.5, seed=7)
+        sqlite_cnxn.execute("INSERT OR IGNORE INTO SurveyStructure VALUES (?, ?, 99)", (SURVEY_ID, QUESTION_ID))
+        sqlite_cnxn.commit()
+        output_filepath = os.path.join(tmp, "AllSurveyDataSQL.csv")
+        reference_filepath = os.path.join(tmp, "reference.csv")
+        for description, changes, expected in SCENARIOS:
+            if callable(changes):
+                changes(sqlite_cnxn)
+            else:
+                for statement in changes:
+                    sqlite_cnxn.execute(statement)
+            sqlite_cnxn.commit()
+            structure = survey_extractor.get_db_struct(sqlite_cnxn)
+            # Silence the information printed by the incremental refresh
+            output = io.StringIO()
+            with redirect_stdout(output):
+                nb_surveys = survey_extractor.refresh_survey_data_incremental(sqlite_cnxn, structure, "union",
+                                                                              output_filepath)
+            full_export = "No reusable previous export" in output.getvalue()
+            if expected is None:
+                assert full_export, "{}: a full export was expected".format(description)
+            else:
+                assert not full_export and nb_surveys == expected, \
+                    "{}: {} survey(s) re-queried instead of {}".format(description, nb_surveys, expected)
+            export_reference(sqlite_cnxn, structure, reference_filepath)
+            assert filecmp.cmp(reference_filepath, output_filepath, shallow=False), \
+                "{}: the refreshed export differs from the full export".format(description)
+            print("[incremental] {:<60} {:>3} survey(s) re-queried".format(
+                description, "all" if full_export else nb_surveys))
+        sqlite_cnxn.close()
+        check_query_cache(tmp)
+        check_change_fingerprint(tmp)
+    print("[OK] The incremental refresh, the query cache and the watch mode detect all the changes.")
+
+
+if __name__ == "__main__":
+    main()
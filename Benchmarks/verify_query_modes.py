@@ -0,0 +1,108 @@
+"""
+Checks the "aggregate" compilation mode of the final query, the client-side pivot and the parallel batched extraction
+against the legacy "union" mode on SQLite stand-ins. All of them are run on the same synthetic databases and their results must be identical once sorted.
+It also checks that the exports of the pipeline are identical to the legacy export ("pd.read_sql()" of the union query
+and "df.to_csv()") when a survey which lacks a question has no respondent.
+
+Usage:
+    python Benchmarks/verify_query_modes.py
+"""
+import filecmp
+import io
+import os
+import tempfile
+import sys
+import time
+from contextlib import redirect_stdout
+from os import path
+
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import survey_extractor  # noqa: E402
+from standin_db import create_standin_db
+
+# (surveys, questions, users, structure density) of the stand-in databases
+CASES = [(3, 4, 1000, 0.5), (10, 30, 2000, 0.3), (25, 60, 3000, 0.1), (5, 10, 500, 1.0), (5, 10, 500, 0.0)]
+
+
+def run_query(query, sqlite_cnxn):
+    """
+    This function runs a query on the stand-in database and returns its result sorted by survey and user.
+    """
+    df = pd.read_sql(query, sqlite_cnxn)
+    return df.sort_values(["SurveyId", "UserId"]).reset_index(drop=True)
+
+
+def check_survey_without_respondents(tmp):
+    """
+    This function creates a stand-in database where the survey 2 lacks the question 3 and has no respondent, so that the
+    result of the final query contains no NULL, and checks that the pipeline exports the same file as the legacy export
+    in the "union" and "client" modes.
+    """
+    db_path = os.path.join(tmp, "no_respondent.db")
+    sqlite_cnxn = create_standin_db(db_path, n_surveys=4, n_questions=6, n_users=300, density=1.0, seed=99)
+    sqlite_cnxn.execute("DELETE FROM SurveyStructure WHERE SurveyId = 2 AND QuestionId = 3")
+    sqlite_cnxn.execute("DELETE FROM Answer WHERE SurveyId = 2")
+    sqlite_cnxn.commit()
+    structure = survey_extractor.get_db_struct(sqlite_cnxn)
+    surveys_without_respondents = survey_extractor.fetch_surveys_without_respondents(sqlite_cnxn)
+    assert surveys_without_respondents == [2], "the survey 2 should have no respondent"
+    assert survey_extractor.get_answer_dtypes(structure, surveys_without_respondents)["ANS_Q3"] == "int64"
+    reference_filepath = os.path.join(tmp, "reference.csv")
+    query = survey_extractor.compile_FinalQuery(structure)
+    pd.read_sql("SELECT * FROM (" + query + ") as t ORDER BY SurveyId, UserId", sqlite_cnxn).to_csv(reference_filepath)
+    sqlite_cnxn.close()
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        for extraction_mode in ("union", "client"):
+            # Silence the banners of the pipeline
+            with redirect_stdout(io.StringIO()):
+                survey_extractor.run_pipeline(None, None, db_path, extraction_mode, backend="sqlite3")
+            assert filecmp.cmp(reference_filepath, "./outputs/AllSurveyDataSQL.csv", shallow=False), \
+                "the {} export differs from the legacy export for a survey without respondents".format(extraction_mode)
+            print("[no respondent] {:>9}: identical to the legacy export".format(extraction_mode))
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    tmp = tempfile.TemporaryDirectory()
+    for seed, (n_surveys, n_questions, n_users, density) in enumerate(CASES):
+        # The stand-in is a file so that the workers of the parallel extraction can open their own connections to it
+        db_path = os.path.join(tmp.name, "standin_{}.db".format(seed))
+        sqlite_cnxn = create_standin_db(db_path, n_surveys=n_surveys, n_questions=n_questions, n_users=n_users,
+                                        density=density, seed=seed)
+        structure = survey_extractor.get_db_struct(sqlite_cnxn)
+        results = {}
+        for query_mode, compiler in survey_extractor.QUERY_COMPILERS.items():
+            start = time.perf_counter()
+            results[query_mode] = run_query(compiler(structure), sqlite_cnxn)
+            print("[{}] {:>9}: {} rows in {:.3f} s".format(
+                seed, query_mode, len(results[query_mode]), time.perf_counter() - start))
+        start = time.perf_counter()
+        results["client"] = pd.concat(list(survey_extractor.extract_pivot_client_side(sqlite_cnxn, structure, batch_size=997)),
+                                      ignore_index=True)
+        print("[{}] {:>9}: {} rows in {:.3f} s".format(
+            seed, "client", len(results["client"]), time.perf_counter() - start))
+        start = time.perf_counter()
+        manager = survey_extractor.ConnectionManager("sqlite3", (db_path,))
+        results["parallel"] = pd.concat(list(survey_extractor.extract_batches_parallel(manager, structure, "aggregate", workers=3)),
+                                        ignore_index=True)
+        manager.close_all()
+        print("[{}] {:>9}: {} rows in {:.3f} s".format(
+            seed, "parallel", len(results["parallel"]), time.perf_counter() - start))
+        # Compare the values only: a column of NULLs has no type of its own in SQLite
+        reference = results["union"].astype("float64")
+        assert reference.equals(results["aggregate"].astype("float64")), "the aggregate query differs"
+        assert reference.equals(results["client"].astype("float64")), "the client-side pivot differs"
+        assert reference.equals(results["parallel"].astype("float64")), "the parallel extraction differs"
+        sqlite_cnxn.close()
+    check_survey_without_respondents(tmp.name)
+    tmp.cleanup()
+    print("[OK] The aggregate query, the client-side pivot and the parallel extraction return the same data as the union query.")
+
+
+if __name__ == "__main__":
+    main()
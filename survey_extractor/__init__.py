@@ -0,0 +1,57 @@
+"""
+Extraction of the "always-fresh" pivoted survey data of the survey database, replicating the dbo.fn_GetAllSurveyDataSQL
+stored function and the dbo.trg_refreshSurveyView trigger.
+
+The functions and classes of the submodules are available from the package itself. The submodules (and numpy/pandas)
+are only imported when one of their attributes is accessed for the first time, so that importing the package is cheap.
+"""
+import importlib
+
+# Public attributes of the package and the submodule each of them is defined in
+_LAZY_ATTRIBUTES = {
+    "ConnectionManager": "connection", "get_connection_manager": "connection", "db_connection": "connection",
+    "get_connection_owner": "connection", "close_conn": "connection",
+    "cursor_query": "structure", "get_db_struct": "structure", "get_db_struct_legacy": "structure",
+    "get_membership_matrix": "structure", "get_answer_dtypes": "structure", "hash_survey_structure": "structure",
+    "fetch_surveys_without_respondents": "structure", "CHECKSUM_MODULUS": "structure", "get_checksum_sql": "structure",
+    "fetch_structure_fingerprint": "structure", "fetch_fingerprint": "structure",
+    "STRUCTURE_FINGERPRINT_PARTS": "structure",
+    "set_strColumnsQueryPart": "query", "set_strCurrentUnionQueryBlock": "query", "write_query": "query",
+    "read_query": "query", "compile_FinalQuery": "query", "compile_SurveyFilter": "query",
+    "compile_AggregateQuery": "query",
+    "QUERY_COMPILERS": "query", "QUERY_FILES": "query", "set_FinalQuery": "query", "set_FinalQuery_legacy": "query",
+    "MAX_STATEMENT_LENGTH": "query", "get_survey_lengths": "query", "split_survey_batches": "query",
+    "QueryCache": "cache", "get_query_cache": "cache", "check_view": "cache",
+    "create_or_alter_view": "cache",
+    "iter_query_chunks": "extract", "iter_answer_batches": "extract", "pivot_answer_batch": "extract",
+    "extract_pivot_client_side": "extract", "extract_batches_parallel": "extract",
+    "OUTPUT_FORMATS": "export", "create_tmp_file": "export", "export_survey_data": "export",
+    "iter_exported_chunks": "export",
+    "fetch_answer_fingerprints": "incremental", "get_survey_fingerprints": "incremental",
+    "splice_survey_data": "incremental", "refresh_survey_data_incremental": "incremental",
+    "LONG_COLUMNS": "compact", "EMPTY_ROW_QUESTION_ID": "compact", "get_int_dtype": "compact",
+    "fetch_answer_bounds": "compact", "get_long_dtypes": "compact", "wide_to_long": "compact",
+    "iter_long_chunks": "compact", "long_to_wide": "compact", "write_long_columns": "compact",
+    "read_survey_data_long": "compact",
+    "run_pipeline": "pipeline",
+    "DATA_FINGERPRINT_PARTS": "watch", "fetch_change_fingerprint": "watch", "run_watch": "watch",
+    "MetricsRecorder": "metrics", "use_metrics_recorder": "metrics", "stage": "metrics",
+    "pkgs_install": "deps",
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    """
+    This function imports the submodule defining the attribute "name" of the package the first time it is accessed.
+    """
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,8 @@
+"""
+Entry point of "python -m survey_extractor".
+"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Cache of the compiled final queries, keyed by the content hash of the survey structure.
+"""
+import json
+import os
+from collections import OrderedDict
+from contextlib import closing
+from os import path
+
+from .export import create_tmp_file
+from .metrics import record, stage, timed_stage
+from .query import QUERY_COMPILERS, QUERY_FILES, write_query
+from .structure import fetch_structure_fingerprint, get_answer_dtypes, get_db_struct, hash_survey_structure
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instructions:
+# 3. Replicate the algorithm of the trigger dbo.trg_refreshSurveyView for creating/altering the view vw_AllSurveyData
+#    whenever applicable.
+# 4. For achieving (3) above, a persistence component (in any format you like: CSV, XML, JSON, etc.), storing the last known
+#    surveys’ structures should be in place.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def write_file_atomically(filepath, text):
+    """
+    This function writes "text" to a unique temporary file next to "filepath" (see "create_tmp_file()") and atomically
+    replaces "filepath" with it, so that a concurrent reader never sees a partially written file.
+    """
+    tmp_filepath = create_tmp_file(filepath)
+    try:
+        with open(tmp_filepath, "w") as f:
+            f.write(text)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+
+
+class QueryCache:
+    """
+    This class stores the compiled final queries keyed by the content hash of the survey structure they were compiled from,
+    with a least recently used (LRU) eviction once more than "max_entries" structures are cached.
+    Each entry also keeps the dtypes of the result of the query and the last server-side fingerprint of the structure,
+    so that an unchanged structure can be recognized without fetching it.
+    The entries are persisted in the "cache_dir" folder: an "index.json" file and one "<hash>.<mode>.sql" file per query.
+    The index is loaded once per process and the queries are kept in memory once read, so that a cache hit in
+    a long-running process does not read any file.
+    The index also records the structure whose query and structure files were last saved in the outputs folder
+    (see "check_view()"), so that they are only written again when another structure is used.
+    """
+
+    def __init__(self, cache_dir="./outputs/query_cache", max_entries=8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        # Entries ordered from the least to the most recently used: {hash: {"fingerprint", "answer_dtypes", "queries"}}
+        self.entries = None
+        self.evicted = None
+        # Hash of the structure of the last saved structure file ("structure") and query file of each mode
+        self.saved = None
+
+    def _read_index(self):
+        """
+        This method reads the index of the cache from disk.
+        It returns the entries of the index (without their queries) and the hashes of the saved files, or empty ones if
+        there is no index or if it cannot be read.
+        """
+        entries = OrderedDict()
+        try:
+            with open(path.join(self.cache_dir, "index.json"), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return entries, {}
+        for entry in index["entries"]:
+            entries[entry["hash"]] = {"fingerprint": entry["fingerprint"], "answer_dtypes": entry["answer_dtypes"],
+                                      "queries": dict.fromkeys(entry["modes"])}
+        return entries, index.get("saved", {})
+
+    def _load(self):
+        """
+        This method loads the index of the cache from disk the first time the cache is used.
+        The queries themselves are only read when they are requested.
+        """
+        if self.entries is not None:
+            return
+        self.entries, self.saved = self._read_index()
+        # Hashes of the entries evicted by this process, whose query files it removes
+        self.evicted = set()
+
+    def _save(self):
+        """
+        This method writes the index of the cache to disk (atomically) and removes the query files of the entries evicted
+        by this process.
+        Several processes may share the cache folder (e.g. overlapping scheduled runs): the entries written in the
+        meantime by the other processes are kept as the least recently used ones, and their query files are never removed
+        unless this process evicts them.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        disk_entries = self._read_index()[0]
+        for structure_hash in reversed(disk_entries):
+            if structure_hash not in self.entries and structure_hash not in self.evicted:
+                self.entries[structure_hash] = disk_entries[structure_hash]
+                self.entries.move_to_end(structure_hash, last=False)
+        while len(self.entries) > self.max_entries:
+            self.evicted.add(self.entries.popitem(last=False)[0])
+        index = {"entries": [{"hash": structure_hash, "fingerprint": entry["fingerprint"],
+                              "answer_dtypes": entry["answer_dtypes"], "modes": list(entry["queries"])}
+                             for structure_hash, entry in self.entries.items()],
+                 "saved": self.saved}
+        write_file_atomically(path.join(self.cache_dir, "index.json"), json.dumps(index))
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".sql") and filename.split(".")[0] in self.evicted:
+                try:
+                    os.remove(path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+    def _touch(self, structure_hash):
+        """
+        This method marks an entry as the most recently used one and persists the new order if it has changed.
+        """
+        if next(reversed(self.entries)) != structure_hash:
+            self.entries.move_to_end(structure_hash)
+            self._save()
+
+    def find_fingerprint(self, fingerprint):
+        """
+        This method returns the hash of the cached structure whose last known server-side fingerprint is "fingerprint",
+        or None if there is no such structure.
+        """
+        self._load()
+        for structure_hash, entry in self.entries.items():
+            if entry["fingerprint"] == fingerprint:
+                return structure_hash
+        return None
+
+    def get(self, structure_hash, query_mode):
+        """
+        This method returns the final query compiled in "query_mode" for the structure "structure_hash" and the dtypes
+        of its result, or None if it is not cached (or if its query file cannot be read).
+        """
+        self._load()
+        entry = self.entries.get(structure_hash)
+        if entry is None or query_mode not in entry["queries"]:
+            return None
+        if entry["queries"][query_mode] is None:
+            # The query file may have been removed by another process: the query is then compiled again
+            try:
+                with open(path.join(self.cache_dir, "{}.{}.sql".format(structure_hash, query_mode)), "r") as f:
+                    entry["queries"][query_mode] = f.read()
+            except OSError:
+                del entry["queries"][query_mode]
+                return None
+        self._touch(structure_hash)
+        return entry["queries"][query_mode], entry["answer_dtypes"]
+
+    def put(self, structure_hash, fingerprint, query_mode, query, answer_dtypes):
+        """
+        This method stores the final query compiled in "query_mode" for the structure "structure_hash", together with
+        the server-side fingerprint of the structure and the dtypes of the result of the query.
+        The least recently used structures are evicted beyond "max_entries".
+        """
+        self._load()
+        entry = self.entries.setdefault(structure_hash, {"fingerprint": fingerprint, "answer_dtypes": answer_dtypes,
+                                                         "queries": {}})
+        entry["fingerprint"] = fingerprint
+        entry["queries"][query_mode] = query
+        self.entries.move_to_end(structure_hash)
+        self.evicted.discard(structure_hash)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_file_atomically(path.join(self.cache_dir, "{}.{}.sql".format(structure_hash, query_mode)), query)
+        self._save()
+
+    def set_fingerprint(self, structure_hash, fingerprint):
+        """
+        This method updates the last known server-side fingerprint of the structure "structure_hash".
+        """
+        self._load()
+        if self.entries[structure_hash]["fingerprint"] != fingerprint:
+            self.entries[structure_hash]["fingerprint"] = fingerprint
+            self._save()
+
+    def is_saved(self, structure_hash, query_mode):
+        """
+        This method returns True if the structure file and the query file of "query_mode" saved in the outputs folder
+        are the ones of the structure "structure_hash".
+        """
+        self._load()
+        return self.saved.get("structure") == structure_hash and self.saved.get(query_mode) == structure_hash
+
+    def set_saved(self, structure_hash, query_mode):
+        """
+        This method records that the structure file and the query file of "query_mode" of the structure "structure_hash"
+        have been saved in the outputs folder.
+        """
+        self._load()
+        self.saved.update({"structure": structure_hash, query_mode: structure_hash})
+        self._save()
+
+
+# Query cache of the process, shared by all the runs of "check_view()" (created the first time it is requested)
+query_cache = None
+
+
+def get_query_cache():
+    """
+    This function returns the query cache of the process, created the first time it is requested.
+    """
+    # Make the "query_cache" variable global so that the cache is shared by all the runs of the process
+    global query_cache
+    if query_cache is None:
+        query_cache = QueryCache()
+    return query_cache
+
+
+@timed_stage("check_view")
+def check_view(sql_conn, query_mode="union", new_view=None, preview=False):
+    """
+    This function takes as input parameters "sql_conn", the connection string to access the database,
+    the compilation mode of the final query (one of the keys of "QUERY_COMPILERS"), optionally the survey structure
+    dataframe if it has already been fetched with the "get_db_struct()" function and whether to print the compiled query
+    and the survey structure.
+    It checks whether the structure of the surveys has changed since the final query was compiled, using the query cache:
+    - if the server-side fingerprint of the structure is known, the cached query is returned without fetching the structure,
+    - otherwise the structure is fetched and hashed, and the cached query of this hash is returned if there is one,
+    - otherwise the final query is compiled and cached.
+    The structure and the query are saved in the outputs folder as updated_survey_structure.csv and saved_query.txt
+    whenever they are not the last saved ones (e.g. on a hit of an older entry of the cache), so that these files always
+    hold the last known structure.
+    It returns the final query and the dtypes of the columns of its result, which only depend on the structure (see
+    "get_answer_dtypes()" for the surveys without any respondent).
+    """
+    print(
+        " ___________________________________________________\n|                                                   |\n|     Check the structure of the survey database    |\n|___________________________________________________|\n")
+    cache = get_query_cache()
+
+    def is_saved(structure_hash):
+        # The files of the outputs folder may have been saved from another entry of the cache, or deleted
+        return cache.is_saved(structure_hash, query_mode) and path.exists("./outputs/" + QUERY_FILES[query_mode]) \
+            and path.exists("./outputs/updated_survey_structure.csv")
+
+    fingerprint = fetch_structure_fingerprint(sql_conn)
+    cached = None
+    # Skip the structure fetch entirely if the fingerprint of the structure on the server is already known
+    if new_view is None:
+        structure_hash = cache.find_fingerprint(fingerprint)
+        cached = cache.get(structure_hash, query_mode) if structure_hash is not None else None
+        if cached is not None:
+            record(cache="hit")
+            print("[INFO] The survey structure has not changed (same server-side fingerprint).\n[INFO] Using the cached final query.\n")
+            if is_saved(structure_hash):
+                return cached
+            # The structure is still needed to save it to the outputs folder
+        new_view = get_db_struct(sql_conn)
+    # Otherwise compare the content hash of the structure with the cached ones
+    if cached is None:
+        structure_hash = hash_survey_structure(new_view)
+        cached = cache.get(structure_hash, query_mode)
+        if cached is not None:
+            cache.set_fingerprint(structure_hash, fingerprint)
+            record(cache="hit")
+            print("[INFO] The survey structure has not changed.\n[INFO] Using the cached final query.\n")
+    # The structure is new: compile the final query and cache it
+    if cached is None:
+        record(cache="miss")
+        print("[INFO] The survey structure has changed or has never been seen.\n[INFO] Compiling the final query...\n")
+        with stage("set_FinalQuery"):
+            cached = QUERY_COMPILERS[query_mode](new_view), get_answer_dtypes(new_view)
+            cache.put(structure_hash, fingerprint, query_mode, *cached)
+    # Save the structure and the query to the outputs folder, unless they are already the saved ones
+    # (a hit on an older entry of the cache, e.g. after a change of structure which has been reverted, saves them again)
+    if is_saved(structure_hash):
+        return cached
+    if not path.exists("./outputs"):
+        os.mkdir("./outputs")
+    write_query(cached[0], QUERY_FILES[query_mode], preview)
+    new_view.to_csv("./outputs/updated_survey_structure.csv", sep=",")
+    record(bytes_written=os.path.getsize("./outputs/updated_survey_structure.csv"))
+    cache.set_saved(structure_hash, query_mode)
+    if preview:
+        print("[PREV] Preview of the survey structure:\n\n", new_view, "\n")
+    print("[SAVE] The survey structure file has successfully been saved as updated_survey_structure.csv.\n")
+    return cached
+
+
+@timed_stage("create_or_alter_view")
+def create_or_alter_view(sql_conn, final_query, backend="pyodbc"):
+    """
+    This function takes as inputs the connection to the database, the final query and the database backend.
+    Like the dbo.trg_refreshSurveyView trigger, it creates or alters the "vw_AllSurveyData" view of the database so that
+    it runs the final query. SQLite has no "CREATE OR ALTER VIEW": the view of a stand-in database is dropped and created.
+    """
+    if backend == "sqlite3":
+        statements = ["DROP VIEW IF EXISTS vw_AllSurveyData", "CREATE VIEW vw_AllSurveyData AS " + final_query]
+    else:
+        statements = ["CREATE OR ALTER VIEW vw_AllSurveyData AS " + final_query]
+    with closing(sql_conn.cursor()) as viewCursor:
+        for statement in statements:
+            viewCursor.execute(statement)
+    sql_conn.commit()
+    record(queries=len(statements))
+    print("[SAVE] The view vw_AllSurveyData has been created or altered on the server.\n")
@@ -0,0 +1,131 @@
+"""
+Non-interactive command line interface of the application, for the scheduled and orchestrated runs.
+Every option can also be given as an environment variable (e.g. SURVEY_DB_SERVER for --server).
+Only the standard library is imported until the arguments have been parsed and the packages have been checked.
+"""
+import argparse
+import os
+import sys
+
+# Environment variables used as default values of the options
+ENV_VARIABLES = {"server": "SURVEY_DB_SERVER", "database": "SURVEY_DB_DATABASE", "driver": "SURVEY_DB_DRIVER",
+                 "backend": "SURVEY_DB_BACKEND", "mode": "SURVEY_EXTRACTION_MODE", "format": "SURVEY_OUTPUT_FORMAT",
+                 "workdir": "SURVEY_WORKDIR", "metrics": "SURVEY_METRICS",
+                 "interval": "SURVEY_WATCH_INTERVAL", "layout": "SURVEY_OUTPUT_LAYOUT"}
+
+
+def build_parser():
+    """
+    This function builds and returns the parser of the command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="survey_extractor",
+        description="Extract the always-fresh pivoted survey data of the survey database to the outputs folder.",
+        epilog="These options can also be set with environment variables: "
+               + ", ".join("--{} {}".format(option, variable) for option, variable in ENV_VARIABLES.items()) + ".")
+    parser.add_argument("--server", default=os.environ.get(ENV_VARIABLES["server"]),
+                        help="name of the SQL Server instance (ignored by the sqlite3 backend)")
+    parser.add_argument("--database", default=os.environ.get(ENV_VARIABLES["database"]),
+                        help="name of the database, or path of the database file with the sqlite3 backend")
+    parser.add_argument("--driver", default=os.environ.get(ENV_VARIABLES["driver"]),
+                        help="ODBC driver (default: the installed '... for SQL Server' driver)")
+    parser.add_argument("--backend", choices=["pyodbc", "sqlite3"],
+                        default=os.environ.get(ENV_VARIABLES["backend"], "pyodbc"),
+                        help="database backend (default: %(default)s)")
+    parser.add_argument("--mode", choices=["union", "aggregate", "client"],
+                        default=os.environ.get(ENV_VARIABLES["mode"], "union"),
+                        help="extraction mode of the survey data (default: %(default)s)")
+    parser.add_argument("--format", choices=["csv", "parquet", "feather"],
+                        default=os.environ.get(ENV_VARIABLES["format"], "csv"),
+                        help="output format of the survey data (default: %(default)s)")
+    parser.add_argument("--layout", choices=["wide", "long"], default=os.environ.get(ENV_VARIABLES["layout"], "wide"),
+                        help="layout of the survey data: one column per question, or compact (UserId, SurveyId, "
+                             + "QuestionId, Answer) triples (default: %(default)s)")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows fetched at a time (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true", help="only re-query the surveys which have changed")
+    parser.add_argument("--workers", type=int, default=1, help="worker threads of the batched extraction")
+    parser.add_argument("--max-statement-length", type=int, default=None,
+                        help="maximum length of a statement of the batched extraction")
+    parser.add_argument("--push-view", action="store_true",
+                        help="create or alter the vw_AllSurveyData view on the server, like trg_refreshSurveyView")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and refresh the outputs whenever the database changes "
+                             + "(incremental refresh, except in the client mode)")
+    parser.add_argument("--interval", type=float, default=float(os.environ.get(ENV_VARIABLES["interval"], 60)),
+                        help="seconds between two polls of the watch mode (default: %(default)s)")
+    parser.add_argument("--debounce", type=float, default=5,
+                        help="seconds without change ending a burst of changes in the watch mode (default: %(default)s)")
+    parser.add_argument("--preview", action="store_true",
+                        help="print the previews: 10 first rows of vw_AllSurveyData, final query and survey structure")
+    parser.add_argument("--workdir", default=os.environ.get(ENV_VARIABLES["workdir"]),
+                        help="folder in which the outputs folder is written (default: the current folder)")
+    parser.add_argument("--metrics", default=os.environ.get(ENV_VARIABLES["metrics"]),
+                        help="file the metrics of each stage are appended to as JSON lines ('-' for stderr)")
+    parser.add_argument("--profile", default=None, help="file the cProfile statistics of the run are saved to")
+    parser.add_argument("--check-pkgs", action="store_true",
+                        help="check the required packages again even if they have already been checked")
+    return parser
+
+
+def main(argv=None):
+    """
+    This function takes as input the list of the command line arguments (by default, the ones of the process).
+    It checks the required packages (once per environment), then runs the full extraction pipeline with the parsed options.
+    The server and database names are only asked interactively when they are missing and a user is at the terminal.
+    It returns the exit code of the process.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # Ask the user for the missing names only if there is a user to answer: unattended runs must not block on input
+    if args.server is None and args.backend == "pyodbc":
+        if not sys.stdin.isatty():
+            parser.error("the server name is required (--server or {})".format(ENV_VARIABLES["server"]))
+        args.server = input("Please enter the server name you want to connect to: ")
+    if args.database is None:
+        if not sys.stdin.isatty():
+            parser.error("the database name is required (--database or {})".format(ENV_VARIABLES["database"]))
+        args.database = input("Please enter the name of the database you want to access to: ")
+    print("// BEGIN SCRIPT //\n")
+    # Make sure all the necessary packages are installed in the working environment (skipped once they have been checked)
+    from .deps import BACKEND_PKGS, FORMAT_PKGS, REQUIRED_PKGS, pkgs_install
+    pkgs = dict(REQUIRED_PKGS, **BACKEND_PKGS[args.backend], **FORMAT_PKGS[args.format])
+    pkgs_install(pkgs, force=args.check_pkgs)
+    try:
+        from .pipeline import run_pipeline
+    except ImportError:
+        # A package has been removed since the last check: check and install the packages again
+        pkgs_install(pkgs, force=True)
+        from .pipeline import run_pipeline
+    # List all the pyodbc drivers and automatically select the right one: the driver should look like "ODBC Driver 17 for SQL Server"
+    if args.driver is None and args.backend == "pyodbc":
+        import pyodbc
+        args.driver = next((x for x in pyodbc.drivers() if x.endswith(" for SQL Server")), "")
+    print(
+        " ___________________________________________________\n|                                                   |\n|    Initialization of the connection parameters    |\n|___________________________________________________|\n")
+    print("[INFO] The SQL driver used is: " + str(args.driver))
+    print("[INFO] The server used is: " + str(args.server))
+    print("[INFO] The database used is: " + str(args.database) + "\n")
+    # Collect the metrics of the stages only if they are requested (the paths are relative to the launch folder)
+    metrics_recorder = None
+    if args.metrics or args.profile:
+        from .metrics import MetricsRecorder
+        metrics_recorder = MetricsRecorder(
+            sink=args.metrics if args.metrics in (None, "-") else os.path.abspath(args.metrics),
+            profile_filepath=args.profile and os.path.abspath(args.profile))
+    if args.workdir:
+        os.chdir(args.workdir)
+    pipeline_kwargs = dict(extraction_mode=args.mode, output_format=args.format, chunksize=args.chunksize,
+                           incremental=args.incremental, backend=args.backend, preview=args.preview, workers=args.workers,
+                           max_statement_length=args.max_statement_length, metrics_recorder=metrics_recorder,
+                           layout=args.layout)
+    if args.watch:
+        # Poll the database and only refresh the surveys which have changed
+        from .watch import run_watch
+        pipeline_kwargs["incremental"] = args.mode != "client"
+        run_watch(args.driver, args.server, args.database, args.interval, args.debounce, args.push_view,
+                  **pipeline_kwargs)
+    else:
+        # Run the full pipeline
+        run_pipeline(args.driver, args.server, args.database, push_view=args.push_view, **pipeline_kwargs)
+    print("// END SCRIPT //")
+    return 0
@@ -0,0 +1,174 @@
+"""
+Compact long-format representation of the pivoted survey data: one typed (UserId, SurveyId, QuestionId, Answer) triple
+per answer cell of a question in the survey, instead of one "ANS_Q<id>" column per question of the catalogue.
+"""
+import json
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from .export import iter_exported_chunks
+from .metrics import record
+
+# Columns of the long format
+LONG_COLUMNS = ["UserId", "SurveyId", "QuestionId", "Answer"]
+# Question id of the triple which stands for a (survey, user) row without any question in the survey
+EMPTY_ROW_QUESTION_ID = -1
+
+
+def get_int_dtype(min_value, max_value, nullable=False):
+    """
+    This function takes as inputs the bounds of the values of a column and whether the column may hold NULL values.
+    It returns the smallest signed integer dtype holding these values: "int8" to "int64", or the nullable pandas dtypes
+    "Int8" to "Int64" if "nullable" is True.
+    """
+    for bits in (8, 16, 32):
+        info = np.iinfo("int{}".format(bits))
+        if info.min <= min_value and max_value <= info.max:
+            break
+    else:
+        bits = 64
+    return ("Int{}" if nullable else "int{}").format(bits)
+
+
+def fetch_answer_bounds(sql_conn):
+    """
+    This function takes as input the connection to the database.
+    It fetches in a single query the maximum user id and the bounds of the answer values of the "Answer" table.
+    It returns them as a list [max user id, min answer value, max answer value] (None for an empty table).
+    """
+    with closing(sql_conn.cursor()) as boundsCursor:
+        boundsCursor.execute("SELECT MAX(UserId), MIN(Answer_Value), MAX(Answer_Value) FROM Answer")
+        record(queries=1, rows=1)
+        return [None if value is None else int(value) for value in boundsCursor.fetchone()]
+
+
+def get_long_dtypes(survey_structure_df, answer_bounds):
+    """
+    This function takes as inputs the survey structure dataframe created with the "get_db_struct()" function and the
+    bounds of the answers returned by "fetch_answer_bounds()".
+    It returns the dtypes of the columns of the long format: the smallest integer dtypes holding the ids, and a nullable
+    integer dtype holding the answers, the -1 of the unanswered questions and the NULL of the rows without any question.
+    """
+    max_user_id, min_answer, max_answer = [0 if value is None else value for value in answer_bounds]
+    return {"UserId": get_int_dtype(0, max_user_id),
+            "SurveyId": get_int_dtype(0, survey_structure_df["SurveyId"].max() if len(survey_structure_df) else 0),
+            "QuestionId": get_int_dtype(EMPTY_ROW_QUESTION_ID,
+                                        survey_structure_df["QuestionId"].max() if len(survey_structure_df) else 0),
+            "Answer": get_int_dtype(min(min_answer, -1), max_answer, nullable=True)}
+
+
+def wide_to_long(df, long_dtypes):
+    """
+    This function takes as inputs a dataframe of pivoted survey data (in the layout of the "vw_AllSurveyData" view) and
+    the dtypes of "get_long_dtypes()".
+    It keeps one triple per non-NULL answer cell, i.e. per question in the survey of the row (its answer, or -1 if it
+    was not answered). A row without any question in its survey is kept as a single triple with the question id -1 and
+    a NULL answer, so that no (survey, user) row is lost.
+    It returns the triples as a dataframe, in the order of the rows and then of the questions.
+    """
+    answer_columns = [column for column in df.columns if column.startswith("ANS_Q")]
+    question_ids = np.array([int(column[len("ANS_Q"):]) for column in answer_columns], dtype=np.int64)
+    answers = df[answer_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    is_cell = ~np.isnan(answers)
+    # Position of the non-NULL cells, row by row, then of the rows without any of them
+    row_pos, column_pos = np.nonzero(is_cell)
+    empty_rows = np.flatnonzero(~is_cell.any(axis=1))
+    # Merge them back in the order of the rows (the cells of a row stay in the order of the questions)
+    all_rows = np.concatenate([row_pos, empty_rows])
+    order = np.argsort(all_rows, kind="stable")
+    all_rows = all_rows[order]
+    long_df = pd.DataFrame({
+        "UserId": df["UserId"].to_numpy()[all_rows],
+        "SurveyId": df["SurveyId"].to_numpy()[all_rows],
+        "QuestionId": np.concatenate([question_ids[column_pos],
+                                      np.full(len(empty_rows), EMPTY_ROW_QUESTION_ID, dtype=np.int64)])[order],
+        # The NaN of the rows without any question become NULL values of the nullable integer dtype
+        "Answer": pd.array(np.concatenate([answers[row_pos, column_pos], np.full(len(empty_rows), np.nan)])[order],
+                           dtype="Float64"),
+    })
+    return long_df.astype(long_dtypes)
+
+
+def iter_long_chunks(chunks, long_dtypes):
+    """
+    This function takes as inputs an iterable of dataframes of pivoted survey data and the dtypes of "get_long_dtypes()".
+    It yields each dataframe converted to the long format (see "wide_to_long()").
+    """
+    for df in chunks:
+        yield wide_to_long(df, long_dtypes)
+
+
+def long_to_wide(long_df, answer_dtypes, sparse=False):
+    """
+    This function takes as inputs a dataframe of triples in the long format (ordered by survey and user, like the output
+    of "wide_to_long()"), the dtypes of the columns of the pivoted survey data returned by "get_answer_dtypes()" and
+    whether to build a sparse frame.
+    It rebuilds the exact pivoted survey data of the "vw_AllSurveyData" view: one row per (survey, user), one "ANS_Q<id>"
+    column per question, NULL (NaN) for the questions which are not in the survey of the row.
+    If "sparse" is True, the columns holding NULL values are pandas sparse arrays which only store the non-NULL cells.
+    It returns the rebuilt dataframe.
+    """
+    survey_ids = long_df["SurveyId"].to_numpy(dtype=np.int64)
+    user_ids = long_df["UserId"].to_numpy(dtype=np.int64)
+    # Number the (survey, user) rows: the triples are ordered by survey and user, so a row starts when one of them changes
+    row_start = np.ones(len(long_df), dtype=bool)
+    row_start[1:] = (survey_ids[1:] != survey_ids[:-1]) | (user_ids[1:] != user_ids[:-1])
+    row_pos = np.cumsum(row_start) - 1
+    nb_rows = int(row_start.sum())
+    # Locate the cells of each question (the triples of the rows without any question are not cells)
+    answer_columns = [column for column in answer_dtypes if column.startswith("ANS_Q")]
+    question_pos = pd.Index([int(column[len("ANS_Q"):]) for column in answer_columns]).get_indexer(
+        long_df["QuestionId"].to_numpy(dtype=np.int64))
+    is_cell = question_pos >= 0
+    answers = long_df["Answer"].to_numpy(dtype=np.float64, na_value=np.nan)
+    wide_df = pd.DataFrame({"UserId": user_ids[row_start], "SurveyId": survey_ids[row_start]})
+    # Group the cells by question so that each column is built from its own cells only
+    column_order = np.argsort(question_pos[is_cell], kind="stable")
+    cell_columns = question_pos[is_cell][column_order]
+    cell_rows = row_pos[is_cell][column_order]
+    cell_answers = answers[is_cell][column_order]
+    bounds = np.searchsorted(cell_columns, np.arange(len(answer_columns) + 1))
+    columns = {}
+    for i, column in enumerate(answer_columns):
+        values = np.full(nb_rows, np.nan)
+        values[cell_rows[bounds[i]:bounds[i + 1]]] = cell_answers[bounds[i]:bounds[i + 1]]
+        if answer_dtypes[column] != "float64":
+            columns[column] = values.astype(answer_dtypes[column])
+        elif sparse:
+            columns[column] = pd.arrays.SparseArray(values, fill_value=np.nan)
+        else:
+            columns[column] = values
+    return pd.concat([wide_df, pd.DataFrame(columns, index=wide_df.index)], axis=1)
+
+
+def get_columns_filepath(output_filepath):
+    """
+    This function returns the path of the file storing the columns of the pivoted survey data of a long-format export.
+    """
+    return output_filepath + ".columns.json"
+
+
+def write_long_columns(output_filepath, answer_dtypes):
+    """
+    This function saves the dtypes of the columns of the pivoted survey data (see "get_answer_dtypes()") next to
+    the long-format export "output_filepath", so that the pivoted survey data can be rebuilt with all its columns,
+    including the questions which are in no survey.
+    """
+    with open(get_columns_filepath(output_filepath), "w") as f:
+        json.dump(answer_dtypes, f)
+
+
+def read_survey_data_long(input_filepath, input_format="csv", sparse=False, chunksize=100000):
+    """
+    This function takes as inputs the path of a long-format export of the pivoted survey data, its format, whether to
+    build a sparse frame and the number of rows read at a time.
+    It reads the triples and the columns saved next to them, and returns the pivoted survey data rebuilt by
+    "long_to_wide()".
+    """
+    with open(get_columns_filepath(input_filepath), "r") as f:
+        answer_dtypes = json.load(f)
+    chunks = list(iter_exported_chunks(input_filepath, input_format, chunksize))
+    long_df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=LONG_COLUMNS)
+    return long_to_wide(long_df, answer_dtypes, sparse)
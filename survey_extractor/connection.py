@@ -0,0 +1,228 @@
+"""
+Connection to the database server: pooled connection managers with a pluggable DB-API backend (pyodbc or sqlite3).
+"""
+import atexit
+import importlib
+import queue
+import time
+from contextlib import closing, contextmanager
+
+from .metrics import record, timed_stage
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 1. Gracefully handle the connection to the database server.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+class ConnectionManager:
+    """
+    This class manages a pool of connections to the database through a pluggable DB-API backend:
+    - "pyodbc" for the SQL Server database, with an ODBC connection string,
+    - "sqlite3" for a local stand-in database, with the path of the database file.
+    The connections released after use are kept (up to "pool_size" idle connections) and reused by the next extractions
+    of the process. Opening a connection is retried "retries" times on transient errors (OperationalError of the backend),
+    waiting "backoff" seconds and then twice as long after each failure.
+    """
+
+    def __init__(self, backend="pyodbc", connect_args=(), connect_kwargs=None, pool_size=4, retries=3, backoff=0.5):
+        self.backend_name = backend
+        # Import the backend module only when the manager is created
+        self.backend = importlib.import_module(backend)
+        self.connect_args = tuple(connect_args)
+        self.connect_kwargs = dict(connect_kwargs or {})
+        # The pooled sqlite3 connections may be reused by other threads than the one which created them
+        if backend == "sqlite3":
+            self.connect_kwargs.setdefault("check_same_thread", False)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_connections = queue.LifoQueue()
+
+    def connect(self):
+        """
+        This method opens a new connection with the backend, retrying with an exponential backoff on transient errors.
+        It returns the new connection.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.backend.connect(*self.connect_args, **self.connect_kwargs)
+            except self.backend.OperationalError as err:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print("[CONN] Transient connection error ({}), retrying in {:.1f} s...".format(err, delay))
+                time.sleep(delay)
+
+    def get_connection(self):
+        """
+        This method returns an idle connection of the pool, or a new connection if there is none.
+        """
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, connection, discard=False):
+        """
+        This method gives a connection back to the pool so that it can be reused, or closes it if "discard" is True
+        (e.g. after an error) or if the pool already holds "pool_size" idle connections.
+        """
+        if discard or self.idle_connections.qsize() >= self.pool_size:
+            connection.close()
+        else:
+            self.idle_connections.put(connection)
+
+    @contextmanager
+    def acquire(self):
+        """
+        This method is a context manager which lends a connection of the pool for the duration of the "with" block.
+        The connection is discarded instead of being reused if any exception is raised in the block (a database error,
+        a pandas error wrapping it or the close of the generator using the connection), as it may be left mid-query.
+        """
+        connection = self.get_connection()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        else:
+            self.release(connection)
+
+    def probe(self, preview=False):
+        """
+        This method checks that the database answers with the lightest possible query ("SELECT 1"), retried like
+        the connection on transient errors.
+        If "preview" is True, it returns a dataframe with the 10 first rows of the "vw_AllSurveyData" view instead.
+        """
+        if preview:
+            # Only import pandas when a preview is requested
+            import pandas as pd
+            if self.backend_name == "sqlite3":
+                my_query = "SELECT * FROM vw_AllSurveyData ORDER BY SurveyId, UserId LIMIT 10"
+            else:
+                my_query = "SELECT TOP 10 * FROM [dbo].[vw_AllSurveyData] ORDER BY SurveyId, UserId"
+        for attempt in range(self.retries + 1):
+            connection = self.get_connection()
+            try:
+                if preview:
+                    result = pd.read_sql(my_query, connection)
+                    record(queries=1, rows=len(result))
+                else:
+                    with closing(connection.cursor()) as probeCursor:
+                        probeCursor.execute("SELECT 1")
+                        result = probeCursor.fetchone()[0] == 1
+                    record(queries=1, rows=1)
+            except self.backend.Error as err:
+                # The connection may be broken (e.g. a stale pooled connection): discard it and retry on a new one
+                self.release(connection, discard=True)
+                if not isinstance(err, self.backend.OperationalError) or attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self.release(connection)
+                return result
+
+    def close_all(self):
+        """
+        This method closes all the idle connections of the pool.
+        """
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Connection managers of the process, by backend and connection parameters, so that the pools are reused from one
+# extraction to the next, and connection manager of the last call to "db_connection()"
+connection_managers = {}
+connection_manager = None
+# Connection of the last call to "db_connection()", until it is given back with "close_conn()"
+sql_cnxn = None
+# Connection manager of each connection lent by "db_connection()" and not given back yet, by id of the connection
+lent_connections = {}
+
+
+def get_connection_manager(backend, *connect_args, **connect_kwargs):
+    """
+    This function takes as inputs the name of the backend ("pyodbc" or "sqlite3") and the arguments of its "connect()"
+    function. It returns the connection manager of the process for these parameters, created the first time it is requested.
+    The idle connections of the manager are closed when the process exits.
+    """
+    key = (backend, connect_args, tuple(sorted(connect_kwargs.items())))
+    if key not in connection_managers:
+        connection_managers[key] = ConnectionManager(backend, connect_args, connect_kwargs)
+        atexit.register(connection_managers[key].close_all)
+    return connection_managers[key]
+
+
+@timed_stage("db_connection")
+def db_connection(driver, server, database, backend="pyodbc", preview=False):
+    """
+    This function takes as inputs the name of the SQL driver, the name of the user's server and the name of the database,
+    and optionally the backend ("pyodbc" by default, or "sqlite3" in which case "database" is the path of a local stand-in
+    database and the driver and server are ignored) and whether to preview the first rows of the "vw_AllSurveyData" view.
+    It checks the connection with a lightweight probe and returns the "sql_cnxn" variable allowing the connection,
+    lent by the connection manager of these parameters (see "get_connection_manager()").
+    """
+    # Make the "sql_cnxn" and "connection_manager" variables global so that they are accessible from everywhere
+    # (even outside this function)
+    global sql_cnxn, connection_manager
+    print(
+        " ___________________________________________________\n|                                                   |\n|         Connection to the database server         |\n|___________________________________________________|\n")
+    if backend == "sqlite3":
+        print("[INFO] My local stand-in database is: \n{}\n".format(database))
+        connection_manager = get_connection_manager(backend, database)
+    else:
+        # Ensure the integration of the driver, the server and the database names to the connection string
+        connection_string = "DRIVER={" + str(driver) + "}; " \
+                            + "SERVER=" + str(server) + "; " \
+                            + "DATABASE=" + str(database) + "; " \
+                            + "Trusted_Connection=yes"
+        print("[INFO] My complete connection command is: \n{}\n".format(connection_string))
+        connection_manager = get_connection_manager(backend, connection_string)
+    # Try to connect to the database
+    try:
+        # Test the connection with a "SELECT 1" probe, or a preview of the "vw_AllSurveyData" view if requested
+        if preview:
+            # Visually check the structure of the database returned
+            # The goal of this exercise is to get the same survey data after running the script
+            print("[PREV] Preview of the 10 first rows of the database:\n\n", connection_manager.probe(preview=True), "\n")
+        else:
+            connection_manager.probe()
+        sql_cnxn = connection_manager.get_connection()
+        lent_connections[id(sql_cnxn)] = connection_manager
+        print("[CONN] The connection to the database server is established.\n")
+        return sql_cnxn
+    # If an error occurs, exit the program and return the error message
+    except connection_manager.backend.Error as err:
+        raise SystemExit("[WARNING] Connection failed.\nPlease check error message:" + str(err.args[-1]))
+
+
+def get_connection_owner(conn_name):
+    """
+    This function takes as input a connection returned by "db_connection()" and not closed yet.
+    It returns the connection manager which lent it (and whose pool the other connections of the extraction come from).
+    """
+    return lent_connections[id(conn_name)]
+
+
+def close_conn(conn_name, discard=False):
+    """
+    This function takes as input the variable name of the connection previously established and whether to discard it
+    (e.g. after an error, as it may be left mid-query).
+    It gives the connection back to the pool of the connection manager which lent it, to be reused by the next extractions
+    of the process, or closes it if it is discarded or was not lent by a connection manager, and deletes the variable.
+    """
+    # Make the "sql_cnxn" variable global so that it no longer points to a connection which has been given back
+    global sql_cnxn
+    if sql_cnxn is conn_name:
+        sql_cnxn = None
+    manager = lent_connections.pop(id(conn_name), None)
+    if manager is not None:
+        manager.release(conn_name, discard)
+    else:
+        conn_name.close()
+    del conn_name
+    print("[CONN] The connection to the server has properly been released and deleted.\n\n")
@@ -0,0 +1,58 @@
+"""
+Check of the third-party packages required by the application, run once per environment.
+"""
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+from os import path
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 6. The Python application should not require the user to install packages before the run.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# Import names and pip names of the third-party packages: always required, required by each backend and by each
+# columnar output format
+REQUIRED_PKGS = {"numpy": "numpy", "pandas": "pandas"}
+BACKEND_PKGS = {"pyodbc": {"pyodbc": "pyodbc"}, "sqlite3": {}}
+FORMAT_PKGS = {"csv": {}, "parquet": {"pyarrow": "pyarrow"}, "feather": {"pyarrow": "pyarrow"}}
+
+
+def get_stamp_filepath(pkgs):
+    """
+    This function takes as input the dictionary of the packages to check.
+    It returns the path of the stamp file recording that these packages are installed for the current Python interpreter,
+    in the user's cache folder.
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    key = hashlib.sha1((sys.executable + sys.version + ",".join(sorted(pkgs))).encode("utf-8")).hexdigest()[:16]
+    return path.join(cache_dir, "survey_extractor", "pkgs_{}.ok".format(key))
+
+
+def pkgs_install(pkgs, force=False):
+    """
+    This function takes as inputs the dictionary {import name: pip name} of the packages required by the run and
+    whether to force the check.
+    It checks whether the packages are installed in the user's environment, without importing them, and installs
+    the missing ones with pip without having the user doing any action before the run.
+    Once all the packages are installed, a stamp file is written so that the next runs skip the check entirely.
+    """
+    stamp_filepath = get_stamp_filepath(pkgs)
+    if path.exists(stamp_filepath) and not force:
+        return
+    print(
+        " ___________________________________________________\n|                                                   |\n|               Packages installation               |\n|___________________________________________________|\n")
+    for p in sorted(pkgs):
+        # Look for the package without importing it
+        if importlib.util.find_spec(p) is None:
+            print("[PKG] {} is not installed and has to be installed.".format(p))
+            subprocess.check_call([sys.executable, "-m", "pip", "install", pkgs[p]])
+            importlib.invalidate_caches()
+        print("[PKG] {} is properly installed.".format(p))
+    os.makedirs(path.dirname(stamp_filepath), exist_ok=True)
+    with open(stamp_filepath, "w") as f:
+        f.write("\n".join(sorted(pkgs)))
+    print("\n[INFO] All packages are installed. You're good to go!\n")
@@ -0,0 +1,108 @@
+"""
+Streaming export of the pivoted survey data to CSV, Parquet or Feather files.
+"""
+import os
+import uuid
+from os import path
+
+import pandas as pd
+
+from .metrics import record, timed_stage
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 5. Of course, extract the "always-fresh" pivoted survey data, in a CSV file, adequately named.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# Output formats of the pivoted survey data and the extension of the file written in each format
+# (the columnar formats "parquet" and "feather" require the pyarrow package)
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+def create_tmp_file(target_filepath):
+    """
+    This function takes as input the path of a file to write.
+    It creates an empty temporary file in the same folder, so that it can atomically replace the file with "os.replace()",
+    under a random name (so that concurrent processes never share it) and with the default permissions of a new file
+    (the umask of the process applies).
+    It returns the path of the temporary file.
+    """
+    tmp_filepath = path.join(path.dirname(path.abspath(target_filepath)),
+                             "." + path.basename(target_filepath) + "." + uuid.uuid4().hex + ".tmp")
+    os.close(os.open(tmp_filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+    return tmp_filepath
+
+
+@timed_stage("export")
+def export_survey_data(chunks, answer_dtypes, output_filepath, output_format="csv"):
+    """
+    This function takes as inputs an iterable of dataframes of pivoted survey data (e.g. from "iter_query_chunks()" or
+    "extract_pivot_client_side()"), the column dtypes of "get_answer_dtypes()", the path of the file to write and
+    its format (one of the keys of "OUTPUT_FORMATS").
+    It appends the chunks one by one to a temporary file next to "output_filepath", so that the memory used only depends
+    on the chunk size, and atomically replaces "output_filepath" with it once the export has finished.
+    If the export fails, the previous version of the file is left untouched.
+    It returns the number of rows written.
+    """
+    if output_format != "csv":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("[WARNING] The {} output format requires the pyarrow package.".format(output_format))
+    # Empty dataframe with the expected columns and dtypes, used for the header and the schema of the output file
+    empty_df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in answer_dtypes.items()})
+    tmp_filepath = create_tmp_file(output_filepath)
+    nb_rows = 0
+    try:
+        if output_format == "csv":
+            with open(tmp_filepath, "w", newline="") as f:
+                empty_df.to_csv(f)
+                for df in chunks:
+                    df = df.astype(answer_dtypes)
+                    # Continue the numbering of the index from one chunk to the next
+                    df.index = pd.RangeIndex(nb_rows, nb_rows + len(df))
+                    df.to_csv(f, header=False)
+                    nb_rows += len(df)
+        else:
+            schema = pa.Schema.from_pandas(empty_df, preserve_index=False)
+            if output_format == "parquet":
+                writer = pq.ParquetWriter(tmp_filepath, schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_file(tmp_filepath, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+            with writer:
+                # Write the schema even if there is no row at all
+                writer.write_table(pa.Table.from_pandas(empty_df, schema=schema, preserve_index=False))
+                for df in chunks:
+                    writer.write_table(pa.Table.from_pandas(df.astype(answer_dtypes), schema=schema,
+                                                            preserve_index=False))
+                    nb_rows += len(df)
+        record(bytes_written=os.path.getsize(tmp_filepath))
+        os.replace(tmp_filepath, output_filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+    return nb_rows
+
+
+def iter_exported_chunks(input_filepath, input_format="csv", chunksize=100000):
+    """
+    This function takes as inputs the path of a file written by "export_survey_data()", its format and the number
+    of rows per chunk.
+    It reads the file back and yields its content as dataframes of at most "chunksize" rows.
+    """
+    if input_format == "csv":
+        with pd.read_csv(input_filepath, index_col=0, chunksize=chunksize) as reader:
+            for df in reader:
+                yield df
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if input_format == "parquet":
+            batches = pq.ParquetFile(input_filepath).iter_batches(batch_size=chunksize)
+        else:
+            reader = pa.ipc.open_file(input_filepath)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        for batch in batches:
+            yield batch.to_pandas()
@@ -0,0 +1,135 @@
+"""
+Extraction of the pivoted survey data: the final query read in chunks or in parallel batches, or the client-side pivot.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from .metrics import record
+from .query import MAX_STATEMENT_LENGTH, QUERY_COMPILERS, split_survey_batches
+from .structure import fetch_surveys_without_respondents, get_answer_dtypes, get_membership_matrix
+
+
+def iter_query_chunks(query, sql_conn, chunksize=100000):
+    """
+    This function takes as inputs the final query, the connection to the database and the number of rows per chunk.
+    It runs the query and yields its result set as dataframes of at most "chunksize" rows, fetched one after the other.
+    The rows are ordered by survey and user, like the output of the client-side pivot.
+    """
+    record(queries=1)
+    for df in pd.read_sql("SELECT * FROM (" + query + ") as t ORDER BY SurveyId, UserId", sql_conn, chunksize=chunksize):
+        record(rows=len(df))
+        yield df
+
+
+def iter_answer_batches(sql_conn, batch_size=100000):
+    """
+    This function takes as inputs the connection to the database and the number of rows to fetch at a time.
+    It streams the narrow "Answer" table once, ordered by survey and user, with "fetchmany()" batches.
+    It yields each batch as a float numpy array of 4 columns: SurveyId, UserId, QuestionId, Answer_Value (NaN for NULL).
+    """
+    # Like the final query, only keep the answers of the users of the "User" table
+    with closing(sql_conn.cursor()) as answerCursor:
+        answerCursor.execute("SELECT a.SurveyId, a.UserId, a.QuestionId, a.Answer_Value FROM Answer as a "
+                             + "INNER JOIN [User] as u ON u.UserId = a.UserId ORDER BY a.SurveyId, a.UserId")
+        record(queries=1)
+        while True:
+            rows = answerCursor.fetchmany(batch_size)
+            if not rows:
+                break
+            record(rows=len(rows))
+            yield np.array([tuple(row) for row in rows], dtype=np.float64)
+
+
+def pivot_answer_batch(answers, list_SID, list_QID, membership):
+    """
+    This function takes as inputs a batch of answers (numpy array outputted by "iter_answer_batches()") holding complete
+    (survey, user) groups, and the survey ids, question ids and membership matrix of "get_membership_matrix()".
+    It pivots the batch into the layout of the final query: one row per (survey, user) group and one "ANS_Q<id>" column
+    per question, set to the answer (or -1) if the question is in the survey and to NaN (NULL) otherwise.
+    It returns the pivoted batch as a dataframe.
+    """
+    # Ignore the answers to the surveys which are not in the survey structure, like the final query
+    survey_pos = pd.Index(list_SID).get_indexer(answers[:, 0])
+    answers, survey_pos = answers[survey_pos >= 0], survey_pos[survey_pos >= 0]
+    # Number the (survey, user) groups: the rows are ordered by survey and user, so a group starts when one of them changes
+    group_start = np.ones(len(answers), dtype=bool)
+    group_start[1:] = (answers[1:, 0] != answers[:-1, 0]) | (answers[1:, 1] != answers[:-1, 1])
+    group_id = np.cumsum(group_start) - 1
+    # Initialize each group with the template of its survey: -1 for the questions in the survey, NaN for the others
+    survey_template = np.where(membership.astype(bool), -1.0, np.nan)
+    pivot = survey_template[survey_pos[group_start]]
+    # Fill in the answers to the questions of the survey (a NULL answer stays -1, like the COALESCE of the final query)
+    question_pos = pd.Index(list_QID).get_indexer(answers[:, 2])
+    is_answer = question_pos >= 0
+    is_answer[is_answer] = membership[survey_pos[is_answer], question_pos[is_answer]].astype(bool)
+    answer_values = answers[is_answer, 3]
+    pivot[group_id[is_answer], question_pos[is_answer]] = np.where(np.isnan(answer_values), -1.0, answer_values)
+    # Store the pivoted batch in a dataframe with the header of the final query
+    df = pd.DataFrame(pivot, columns=["ANS_Q{}".format(question_id) for question_id in list_QID])
+    df.insert(0, "SurveyId", answers[group_start, 0].astype(np.int64))
+    df.insert(0, "UserId", answers[group_start, 1].astype(np.int64))
+    return df
+
+
+def extract_pivot_client_side(sql_conn, survey_structure_df, batch_size=100000, answer_dtypes=None):
+    """
+    This function takes as inputs the connection to the database, the survey structure dataframe created with the
+    "get_db_struct()" function, the number of answers to fetch at a time and optionally the dtypes of the columns
+    (fetched with "get_answer_dtypes()" if not given).
+    It bypasses the dynamic SQL entirely: the "Answer" table is streamed once and pivoted client-side batch by batch,
+    so that the memory used only depends on the batch size.
+    It yields the pivoted survey data as dataframes, ordered by survey and user, with the dtypes of "get_answer_dtypes()".
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    if answer_dtypes is None:
+        answer_dtypes = get_answer_dtypes(survey_structure_df, fetch_surveys_without_respondents(sql_conn))
+    # Answers of the last (survey, user) group of the previous batch, which may continue in the next batch
+    pending = np.empty((0, 4), dtype=np.float64)
+    for batch in iter_answer_batches(sql_conn, batch_size):
+        answers = np.concatenate([pending, batch])
+        # Hold back the last group of the batch, unless it is the only one (then keep growing it)
+        last_start = np.flatnonzero((answers[:, 0] != answers[-1, 0]) | (answers[:, 1] != answers[-1, 1]))
+        if len(last_start) == 0:
+            pending = answers
+            continue
+        pending = answers[last_start[-1] + 1:]
+        yield pivot_answer_batch(answers[:last_start[-1] + 1], list_SID, list_QID, membership).astype(answer_dtypes)
+    if len(pending):
+        yield pivot_answer_batch(pending, list_SID, list_QID, membership).astype(answer_dtypes)
+
+
+def extract_batches_parallel(manager, survey_structure_df, query_mode="union", workers=4,
+                             max_statement_length=MAX_STATEMENT_LENGTH, chunksize=100000):
+    """
+    This function takes as inputs a connection manager (see "ConnectionManager"), the survey structure dataframe created
+    with the "get_db_struct()" function, the compilation mode of the final query, the number of worker threads,
+    the maximum length of a statement and the number of rows fetched at a time.
+    It splits the surveys into batches (see "split_survey_batches()", about 4 batches per worker), compiles the final query
+    of each batch and runs the batches concurrently on a thread pool, each worker using its own pooled connection.
+    It yields the result of each batch as a dataframe, in survey order, so that the merged data is ordered by survey and
+    user whatever the order in which the batches complete.
+    """
+    # Keep one pooled connection per worker so that the connections are reused from one batch to the next
+    manager.pool_size = max(manager.pool_size, workers)
+    batches = split_survey_batches(survey_structure_df, max_statement_length, 4 * workers, query_mode)
+
+    def fetch_batch(batch):
+        batch_structure = survey_structure_df[survey_structure_df["SurveyId"].isin(batch)]
+        with manager.acquire() as connection:
+            return pd.concat(list(iter_query_chunks(QUERY_COMPILERS[query_mode](batch_structure), connection,
+                                                    chunksize)), ignore_index=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit the batches in survey order and yield their results in the same order, keeping at most
+        # 2 batches per worker in flight so that the memory used does not depend on the number of batches
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(fetch_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
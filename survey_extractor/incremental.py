@@ -0,0 +1,139 @@
+"""
+Incremental refresh of the exported survey data: only the surveys which have changed are re-queried.
+"""
+import json
+import os
+from contextlib import closing
+from os import path
+
+import pandas as pd
+
+from .export import create_tmp_file, export_survey_data, iter_exported_chunks
+from .extract import iter_query_chunks
+from .metrics import record, timed_stage
+from .query import QUERY_COMPILERS
+from .structure import fetch_surveys_without_respondents, get_answer_dtypes, get_checksum_sql, get_membership_matrix
+
+
+def fetch_answer_fingerprints(sql_conn):
+    """
+    This function takes as input the connection to the database.
+    It computes in a single grouped query a fingerprint of the answers of each survey given by the users of the "User"
+    table (the final query ignores the others): the number of answers,
+    the maximum user id and a checksum of the (user, question, value) triples (see "get_checksum_sql()").
+    It returns a dictionary {survey id: [count, max user id, checksum]}.
+    """
+    with closing(sql_conn.cursor()) as fingerprintCursor:
+        fingerprintCursor.execute("SELECT a.SurveyId, COUNT(*), MAX(a.UserId), "
+                                  + get_checksum_sql(["a.UserId", "a.QuestionId", "COALESCE(a.Answer_Value, -1)"])
+                                  + " FROM Answer as a INNER JOIN [User] as u ON u.UserId = a.UserId GROUP BY a.SurveyId")
+        rows = fingerprintCursor.fetchall()
+    record(queries=1, rows=len(rows))
+    return {int(row[0]): [int(value) for value in row[1:]] for row in rows}
+
+
+def get_survey_fingerprints(sql_conn, survey_structure_df):
+    """
+    This function takes as inputs the connection to the database and the survey structure dataframe created with the
+    "get_db_struct()" function.
+    It returns the state used by the incremental refresh: the list of all the question ids and, for each survey,
+    the ids of the questions in its structure and the fingerprint of its answers.
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    answer_fingerprints = fetch_answer_fingerprints(sql_conn)
+    return {"questions": [int(question_id) for question_id in list_QID],
+            "surveys": {str(survey_id): {"structure": [int(question_id) for question_id in list_QID[in_survey]],
+                                         "answers": answer_fingerprints.get(int(survey_id))}
+                        for survey_id, in_survey in zip(list_SID, membership.astype(bool))}}
+
+
+def splice_survey_data(old_chunks, new_df, replaced_surveys):
+    """
+    This function takes as inputs the chunks of the previous export (ordered by survey and user), a dataframe with the
+    fresh rows of the re-queried surveys (ordered by survey and user) and the set of the surveys to replace.
+    It drops the rows of the replaced surveys from the previous export and merges the fresh rows in, keeping the order
+    by survey and user.
+    It yields the spliced survey data chunk by chunk.
+    """
+    for df in old_chunks:
+        df = df[~df["SurveyId"].isin(replaced_surveys)]
+        if df.empty:
+            continue
+        # The fresh rows of the surveys which come before the last survey of the chunk are inserted in this chunk
+        is_inserted = new_df["SurveyId"].to_numpy() < df["SurveyId"].iloc[-1]
+        if is_inserted.any():
+            df = pd.concat([df, new_df[is_inserted]]).sort_values(["SurveyId", "UserId"], kind="stable")
+            new_df = new_df[~is_inserted]
+        yield df
+    # The remaining fresh rows come after all the rows of the previous export
+    yield new_df
+
+
+@timed_stage("refresh_incremental")
+def refresh_survey_data_incremental(sql_conn, survey_structure_df, query_mode, output_filepath, output_format="csv",
+                                    chunksize=100000, final_query=None, surveys_without_respondents=None):
+    """
+    This function takes as inputs the connection to the database, the survey structure dataframe created with the
+    "get_db_struct()" function, the compilation mode of the final query, the path and format of the exported file,
+    the number of rows per chunk and optionally the final query of the whole structure (e.g. returned by "check_view()")
+    and the ids of the surveys without respondents (see "fetch_surveys_without_respondents()"), which are compiled and
+    fetched if not given.
+    It compares the fingerprints of the surveys (see "get_survey_fingerprints()") with the ones persisted at the previous
+    run in "<output_filepath>.fingerprints.json" and only re-queries the surveys whose structure or answers have changed.
+    Their rows are spliced into the existing export, which is replaced atomically.
+    A full export is run when there is no previous export or readable fingerprint file, or when the list of questions has
+    changed.
+    It returns the number of surveys which have been re-queried.
+    """
+    # The fingerprints describe the content of one exported file: each output file has its own fingerprint file
+    state_filepath = output_filepath + ".fingerprints.json"
+    new_state = get_survey_fingerprints(sql_conn, survey_structure_df)
+    if surveys_without_respondents is None:
+        surveys_without_respondents = fetch_surveys_without_respondents(sql_conn)
+    answer_dtypes = get_answer_dtypes(survey_structure_df, surveys_without_respondents)
+    old_state = None
+    if path.exists(state_filepath) and path.exists(output_filepath):
+        try:
+            with open(state_filepath, "r") as f:
+                old_state = json.load(f)
+        # An unreadable fingerprint file (e.g. truncated by a crash) is ignored: all the surveys are extracted again
+        except (OSError, ValueError) as err:
+            print("[WARNING] The fingerprints of the previous export cannot be read ({}).".format(err))
+    # Full export: the columns of the export depend on the list of all the questions
+    if old_state is None or old_state["questions"] != new_state["questions"]:
+        print("[INFO] No reusable previous export: all the surveys are extracted.")
+        changed_surveys = set(new_state["surveys"])
+        if final_query is None:
+            final_query = QUERY_COMPILERS[query_mode](survey_structure_df)
+        chunks = iter_query_chunks(final_query, sql_conn, chunksize)
+    else:
+        changed_surveys = {survey_id for survey_id, survey_state in new_state["surveys"].items()
+                           if old_state["surveys"].get(survey_id) != survey_state}
+        removed_surveys = set(old_state["surveys"]) - set(new_state["surveys"])
+        if not changed_surveys and not removed_surveys:
+            print("[INFO] No survey has changed since the previous export.")
+            return 0
+        print("[INFO] {} survey(s) changed and {} survey(s) removed since the previous export.".format(
+            len(changed_surveys), len(removed_surveys)))
+        # Re-query the changed surveys only and splice their rows into the previous export
+        replaced_surveys = [int(survey_id) for survey_id in changed_surveys | removed_surveys]
+        changed_structure = survey_structure_df[survey_structure_df["SurveyId"].isin(replaced_surveys)]
+        new_chunks = []
+        if not changed_structure.empty:
+            new_chunks = list(iter_query_chunks(QUERY_COMPILERS[query_mode](changed_structure), sql_conn, chunksize))
+        new_df = pd.concat(new_chunks, ignore_index=True) if new_chunks else pd.DataFrame(columns=list(answer_dtypes))
+        chunks = splice_survey_data(iter_exported_chunks(output_filepath, output_format, chunksize),
+                                    new_df.astype(answer_dtypes), replaced_surveys)
+    export_survey_data(chunks, answer_dtypes, output_filepath, output_format)
+    # Only persist the new fingerprints once the export has succeeded, atomically so that an interrupted run cannot leave
+    # a truncated file
+    tmp_filepath = create_tmp_file(state_filepath)
+    try:
+        with open(tmp_filepath, "w") as f:
+            json.dump(new_state, f)
+        record(bytes_written=path.getsize(tmp_filepath))
+        os.replace(tmp_filepath, state_filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+    return len(changed_surveys)
@@ -0,0 +1,165 @@
+"""
+Instrumentation of the pipeline: structured per-stage metrics emitted as JSON lines and/or to a callback hook.
+"""
+import cProfile
+import functools
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Counters of each stage, summed over all the queries and writes done while the stage is running
+COUNTERS = ("queries", "rows", "bytes_written")
+
+
+class MetricsRecorder:
+    """
+    This class collects the metrics of the stages of a run (see "stage()") and emits one record per stage when it ends:
+    its name, the name of its parent stage, its wall time, its status ("ok" or "error"), the number of queries issued,
+    the number of rows fetched, the number of bytes written and the outcome of the query cache ("hit" or "miss", if the
+    stage looked it up). The counters of a stage include the ones of its nested stages.
+    The records are written as JSON lines to "sink" (a path, opened in append mode, or a file object; "-" for stderr)
+    and/or passed as dictionaries to "callback".
+    If "profile_filepath" is given, the outermost stage runs under cProfile and its statistics are saved to this file
+    (readable with the "pstats" module).
+    """
+
+    def __init__(self, sink=None, callback=None, profile_filepath=None):
+        self.sink = sink
+        self.callback = callback
+        self.profile_filepath = profile_filepath
+        self.run_id = uuid.uuid4().hex
+        # Stages currently running, from the outermost to the innermost one
+        self.open_stages = []
+        # The counters may be updated by the worker threads of the parallel extraction
+        self.lock = threading.Lock()
+        self.profiler = None
+
+    def begin(self, name):
+        """
+        This method opens the stage "name" and returns its record.
+        """
+        with self.lock:
+            stage_record = {"event": "stage", "run_id": self.run_id, "stage": name,
+                            "parent": self.open_stages[-1]["stage"] if self.open_stages else None,
+                            "start": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                            "wall_time_s": None, "status": None, "cache": None}
+            stage_record.update(dict.fromkeys(COUNTERS, 0))
+            stage_record["_start"] = time.perf_counter()
+            self.open_stages.append(stage_record)
+        if len(self.open_stages) == 1 and self.profile_filepath:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return stage_record
+
+    def end(self, stage_record, status="ok"):
+        """
+        This method closes the stage of "stage_record" with the given status and emits its record.
+        """
+        stage_record["wall_time_s"] = round(time.perf_counter() - stage_record.pop("_start"), 6)
+        stage_record["status"] = status
+        with self.lock:
+            self.open_stages = [open_stage for open_stage in self.open_stages if open_stage is not stage_record]
+        if not self.open_stages and self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_filepath)
+            self.profiler = None
+            stage_record["profile"] = self.profile_filepath
+        self.emit(stage_record)
+
+    def record(self, cache=None, **counters):
+        """
+        This method adds the given counters (see "COUNTERS") to all the running stages and, if "cache" is given,
+        sets the outcome of the query cache of these stages.
+        """
+        with self.lock:
+            for stage_record in self.open_stages:
+                for counter, value in counters.items():
+                    stage_record[counter] += value
+                if cache is not None:
+                    stage_record["cache"] = cache
+
+    def emit(self, stage_record):
+        """
+        This method writes a record as a JSON line to the sink and passes it to the callback, if any.
+        """
+        if self.sink is not None:
+            line = json.dumps(stage_record) + "\n"
+            if self.sink == "-":
+                sys.stderr.write(line)
+            elif isinstance(self.sink, str):
+                with open(self.sink, "a") as f:
+                    f.write(line)
+            else:
+                self.sink.write(line)
+                self.sink.flush()
+        if self.callback is not None:
+            self.callback(dict(stage_record))
+
+
+# Metrics recorder of the current run (no metrics are collected when there is none)
+metrics_recorder = None
+
+
+@contextmanager
+def use_metrics_recorder(recorder):
+    """
+    This function is a context manager which makes "recorder" the metrics recorder of the process for the duration of
+    the "with" block. It does nothing if "recorder" is None.
+    """
+    # Make the "metrics_recorder" variable global so that the stages of all the modules report to it
+    global metrics_recorder
+    if recorder is None:
+        yield
+        return
+    previous_recorder, metrics_recorder = metrics_recorder, recorder
+    try:
+        yield
+    finally:
+        metrics_recorder = previous_recorder
+
+
+@contextmanager
+def stage(name):
+    """
+    This function is a context manager which measures the block it wraps as the stage "name" of the current metrics
+    recorder (see "MetricsRecorder"). It does nothing if there is no metrics recorder.
+    """
+    recorder = metrics_recorder
+    if recorder is None:
+        yield
+        return
+    stage_record = recorder.begin(name)
+    try:
+        yield
+    except BaseException:
+        recorder.end(stage_record, "error")
+        raise
+    recorder.end(stage_record)
+
+
+def timed_stage(name):
+    """
+    This function returns a decorator which measures each call of the decorated function as the stage "name".
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(cache=None, **counters):
+    """
+    This function adds the given counters ("queries", "rows", "bytes_written") to the running stages of the current
+    metrics recorder and, if "cache" is given ("hit" or "miss"), sets their outcome of the query cache.
+    It does nothing if there is no metrics recorder.
+    """
+    recorder = metrics_recorder
+    if recorder is not None:
+        recorder.record(cache, **counters)
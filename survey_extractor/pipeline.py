@@ -0,0 +1,112 @@
+"""
+Full extraction pipeline: connection, structure check, extraction and export of the pivoted survey data.
+"""
+import os
+from os import path
+
+from .cache import check_view, create_or_alter_view
+from .compact import fetch_answer_bounds, get_long_dtypes, iter_long_chunks, write_long_columns
+from .connection import close_conn, db_connection, get_connection_owner
+from .export import OUTPUT_FORMATS, export_survey_data
+from .extract import extract_batches_parallel, extract_pivot_client_side, iter_query_chunks
+from .incremental import refresh_survey_data_incremental
+from .metrics import stage, use_metrics_recorder
+from .query import MAX_STATEMENT_LENGTH
+from .structure import fetch_surveys_without_respondents, get_answer_dtypes, get_db_struct
+
+
+# Define the "run_pipeline()" function which gathers all the previously created functions organized in the correct order of execution to output the required result
+def run_pipeline(sql_driver, my_server, my_database, extraction_mode="union", output_format="csv", chunksize=100000,
+                 incremental=False, backend="pyodbc", preview=False, workers=1, max_statement_length=None,
+                 metrics_recorder=None, push_view=False, layout="wide"):
+    """
+    This function takes as inputs the name of the SQL driver, the name of the user's server and the name of the database,
+    and optionally:
+    - the extraction mode of the survey data: "union" (default) or "aggregate" to run the final query compiled in this
+      mode (see "QUERY_COMPILERS") on the server, "client" to stream the "Answer" table and pivot it client-side,
+    - the output format of the survey data, one of the keys of "OUTPUT_FORMATS" ("csv" by default),
+    - the number of rows fetched and written at a time,
+    - whether to only re-query the surveys which have changed since the previous run (not available in the "client" mode),
+    - the database backend: "pyodbc" (default) or "sqlite3" to run against a local stand-in database (see "db_connection()"),
+    - whether to print the previews: the first rows of the "vw_AllSurveyData" view when connecting, the compiled final
+      query and the survey structure (off by default, as they can be large),
+    - the number of worker threads and the maximum length of a statement: if more than one worker or a maximum length is
+      given, the final query is split into batches of surveys run concurrently (see "extract_batches_parallel()"),
+    - a "MetricsRecorder" receiving the wall time, queries, rows, bytes written and cache outcome of each stage,
+    - whether to create or alter the "vw_AllSurveyData" view on the server with the final query, like the
+      dbo.trg_refreshSurveyView trigger (with the "union" query in the "client" mode),
+    - the layout of the output: "wide" (default) for the layout of the "vw_AllSurveyData" view, or "long" for compact
+      typed (UserId, SurveyId, QuestionId, Answer) triples (see "wide_to_long()"), always fully exported.
+    It runs all the nested sub-functions and outputs the required result in a file "AllSurveyDataSQL.<format>"
+    (or "AllSurveyDataLong.<format>" in the "long" layout) in the outputs folder.
+    The required packages are expected to be installed (see "pkgs_install()", run once by the command line interface).
+    """
+    # Report the metrics of the stages of the run to "metrics_recorder", if any
+    with use_metrics_recorder(metrics_recorder), stage("pipeline"):
+        # 1. Connect to the database and get the structure of the surveys if the extraction needs it
+        # (the full export of the final query does not: the query cache may even skip the structure fetch)
+        current_cnxn = db_connection(sql_driver, my_server, my_database, backend, preview)
+        # Discard the connection if any step fails, as it may be left mid-query
+        try:
+            survey_structure = None
+            batched = workers > 1 or max_statement_length is not None
+            if extraction_mode == "client" or incremental or batched or layout == "long":
+                survey_structure = get_db_struct(current_cnxn)
+            # 2. Check if the survey structure has changed and store the final query in the "my_final_query" variable
+            # (the "client" mode does not need any final query)
+            if extraction_mode != "client":
+                my_final_query, answer_dtypes = check_view(current_cnxn, extraction_mode, survey_structure, preview)
+            # The dtypes of the structure are only those of "pd.read_sql()" if every survey has respondents: otherwise
+            # they are computed again from the structure without the surveys which have no row in the result
+            surveys_without_respondents = fetch_surveys_without_respondents(current_cnxn)
+            if surveys_without_respondents and survey_structure is None:
+                survey_structure = get_db_struct(current_cnxn)
+            if extraction_mode == "client" or surveys_without_respondents:
+                answer_dtypes = get_answer_dtypes(survey_structure, surveys_without_respondents)
+            # Replicate the dbo.trg_refreshSurveyView trigger if requested: the view runs the final query on the server
+            if push_view:
+                if extraction_mode == "client":
+                    my_final_query = check_view(current_cnxn, "union", survey_structure, preview)[0]
+                create_or_alter_view(current_cnxn, my_final_query, backend)
+            # 3. Stream all the survey data and save it as "AllSurveyDataSQL.<format>"
+            print(
+                " ___________________________________________________\n|                                                   |\n|          Get and save all the survey data         |\n|___________________________________________________|\n")
+            if not path.exists("./outputs"):
+                os.mkdir("./outputs")
+            output_filename = "AllSurveyDataSQL" + OUTPUT_FORMATS[output_format]
+            if layout == "long":
+                output_filename = "AllSurveyDataLong" + OUTPUT_FORMATS[output_format]
+            if incremental and extraction_mode != "client" and layout == "wide":
+                # 4-5. Only re-query the surveys which have changed and splice them into the previous export
+                nb_surveys = refresh_survey_data_incremental(current_cnxn, survey_structure, extraction_mode,
+                                                             "./outputs/" + output_filename, output_format, chunksize,
+                                                             my_final_query, surveys_without_respondents)
+                print("[SAVE] {} survey(s) have been refreshed in the outputs folder in {}.\n".format(
+                    nb_surveys, output_filename))
+            else:
+                # 4. Fetch the survey data chunk by chunk, either from the final query or from the client-side pivot
+                if extraction_mode == "client":
+                    chunks = extract_pivot_client_side(current_cnxn, survey_structure, chunksize, answer_dtypes)
+                elif batched:
+                    chunks = extract_batches_parallel(get_connection_owner(current_cnxn), survey_structure,
+                                                      extraction_mode, workers,
+                                                      max_statement_length or MAX_STATEMENT_LENGTH, chunksize)
+                else:
+                    chunks = iter_query_chunks(my_final_query, current_cnxn, chunksize)
+                # 5. Append the chunks to the output file, which is only replaced once the export has finished
+                # (in the "long" layout, each chunk is converted to triples and the wide columns are saved next to
+                # the file)
+                if layout == "long":
+                    long_dtypes = get_long_dtypes(survey_structure, fetch_answer_bounds(current_cnxn))
+                    nb_rows = export_survey_data(iter_long_chunks(chunks, long_dtypes), long_dtypes,
+                                                 "./outputs/" + output_filename, output_format)
+                    write_long_columns("./outputs/" + output_filename, answer_dtypes)
+                else:
+                    nb_rows = export_survey_data(chunks, answer_dtypes, "./outputs/" + output_filename, output_format)
+                print("[SAVE] {} rows have successfully been saved to the outputs folder as {}.\n".format(
+                    nb_rows, output_filename))
+        except BaseException:
+            close_conn(current_cnxn, discard=True)
+            raise
+        # 6. Give the connection back to the pool (closed when the process exits) and delete it
+        close_conn(current_cnxn)
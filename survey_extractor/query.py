@@ -0,0 +1,310 @@
+"""
+Compilation of the final query which pivots the survey data, replicating dbo.fn_GetAllSurveyDataSQL.
+"""
+import os
+from os import path
+
+import numpy as np
+
+from .metrics import record, timed_stage
+from .structure import get_membership_matrix
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 2. Replicate the algorithm of the dbo.fn_GetAllSurveyDataSQL stored function.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def set_strColumnsQueryPart(currentQuestionId, currentInSurvey):
+    """
+    This function takes as inputs the current question id and the current in survey outputted from the "db_struct" dataframe
+    and sets two versions of a query depending on the input variables:
+    - one type of query if the current question is in the current survey
+    - one type of query if the current question is not in the current survey
+    It creates the nested variables which will be looped over in the final query function.
+    It returns the proper SQL string as "strColumnsQueryPart".
+    """
+    # Set the query string variables to get the correct values
+    strQueryTemplateForAnswerColumn = "COALESCE((SELECT a.Answer_Value FROM Answer as a WHERE a.UserId = u.UserId " \
+                                      + "AND a.SurveyId = <SURVEY_ID> AND a.QuestionId = <QUESTION_ID>), -1) " \
+                                      + "AS ANS_Q<QUESTION_ID>"
+    strQueryTemplateForNullColumn = "NULL AS ANS_Q<QUESTION_ID>"
+    # If the current question is not in the current survey, the values in this column are set to NULL
+    if currentInSurvey == 0:
+        strColumnsQueryPart = strQueryTemplateForNullColumn.replace("<QUESTION_ID>", str(currentQuestionId))
+    # If the current question is in the current survey, get the answer for the right survey id and question id
+    else:
+        strColumnsQueryPart = strQueryTemplateForAnswerColumn.replace("<QUESTION_ID>", str(currentQuestionId))
+    # Return the "strColumnsQueryPart" variable as a string to make sure it will work in the next function
+    return str(strColumnsQueryPart)
+
+
+def set_strCurrentUnionQueryBlock(currentSurveyId, strColumnsQueryPart):
+    """
+    This function takes as inputs the current survey id and the string query created in the "set_strColumnsQueryPart()" function.
+    It unions query pieces to output the "strCurrentUnionQueryBlock" string which will be used later to look over surveys.
+    """
+    # Define the string variable "strQueryTemplateOuterUnionQuery" and build the "strCurrentUnionQueryBlock" string with replacements
+    strQueryTemplateOuterUnionQuery = "SELECT UserId, <SURVEY_ID> as SurveyId, <DYNAMIC_QUESTION_ANSWERS> " \
+                                      + "FROM [User] as u WHERE EXISTS (SELECT * FROM Answer as a " \
+                                      + "WHERE u.UserId = a.UserId AND a.SurveyId = <SURVEY_ID>)"
+    strCurrentUnionQueryBlock = ""
+    strCurrentUnionQueryBlock = strQueryTemplateOuterUnionQuery.replace("<DYNAMIC_QUESTION_ANSWERS>",
+                                                                        str(strColumnsQueryPart))
+    strCurrentUnionQueryBlock = strCurrentUnionQueryBlock.replace("<SURVEY_ID>", str(currentSurveyId))
+    return str(strCurrentUnionQueryBlock)
+
+
+def write_query(query_to_write, query_filename="saved_query.txt", preview=False):
+    """
+    This function takes an SQL query and the name of the text file as inputs and save the query to this text file.
+    The query is only printed if "preview" is True: the final query can be several megabytes long.
+    """
+    # Make the "filepath" variable global so that it is accessible from everywhere
+    global filepath
+    # If the "outputs" folder does not exist yet, create it. If it does, do nothing
+    if not path.exists("./outputs"):
+        os.mkdir("./outputs")
+    # Save the "query_to_write" string in a text file
+    # n.b. the "with open" statement will automatically close the file once we're done
+    filepath = "./outputs/" + query_filename
+    with open(filepath, "w") as f:
+        f.write(query_to_write)
+        if preview:
+            print("[PREV] Preview of the final query:\n\n'", query_to_write, "'\n")
+        print("[SAVE] The final query has been saved to disk as {} in the outputs folder.\n".format(query_filename))
+    record(bytes_written=len(query_to_write))
+
+
+def read_query(query_to_read):
+    """
+    This function takes as input an SQL query, reads it and store it to another variable.
+    """
+    # Make the "my_final_query" variable global so that it is accessible from everywhere
+    global my_final_query
+    # Read the query and store it to the "my_final_query" variable
+    with open(query_to_read, "r") as f:
+        my_final_query = f.read()
+        return my_final_query
+
+
+def compile_FinalQuery(survey_structure_df):
+    """
+    This function takes as input the survey structure dataframe created with the "get_db_struct()" function.
+    It builds the membership matrix once and emits the same SQL text as the legacy "set_FinalQuery_legacy()" function,
+    assembling the column statements and the UNION blocks with "str.join()" in linear time.
+    It is a pure function: it returns the final query as a string and does not write anything to disk.
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    # Pre-render the pieces of the column statements which only depend on the question id
+    strAnswerColumnPrefix = "COALESCE((SELECT a.Answer_Value FROM Answer as a WHERE a.UserId = u.UserId " \
+                            + "AND a.SurveyId = "
+    listAnswerColumnSuffix = [" AND a.QuestionId = {0}), -1) AS ANS_Q{0}".format(q) for q in list_QID]
+    listNullColumn = ["NULL AS ANS_Q{}".format(q) for q in list_QID]
+    # Build one UNION block per survey, picking for each question the NULL or the answer column statement
+    listUnionQueryBlocks = []
+    for survey_pos, survey_id in enumerate(list_SID):
+        strSurveyId = str(survey_id)
+        strColumnsQueryPart = ", ".join(
+            strAnswerColumnPrefix + strSurveyId + listAnswerColumnSuffix[question_pos] if in_survey
+            else listNullColumn[question_pos]
+            for question_pos, in_survey in enumerate(membership[survey_pos].tolist()))
+        listUnionQueryBlocks.append("SELECT UserId, " + strSurveyId + " as SurveyId, " + strColumnsQueryPart
+                                    + " FROM [User] as u WHERE EXISTS (SELECT * FROM Answer as a "
+                                    + "WHERE u.UserId = a.UserId AND a.SurveyId = " + strSurveyId + ")")
+    return " UNION ".join(listUnionQueryBlocks)
+
+
+def compile_SurveyFilter(list_SID, strSurveyColumn="a.SurveyId"):
+    """
+    This function takes as inputs a list of survey ids and the SQL column holding the survey id.
+    It returns a SQL condition keeping the rows of these surveys only, written as ranges of consecutive ids
+    ("<column> BETWEEN <first id> AND <last id>") so that its length depends on the number of gaps between the ids
+    rather than on the number of surveys: a single range for the surveys of a table without deleted rows.
+    """
+    survey_ids = np.unique(np.asarray(list_SID, dtype=np.int64))
+    if len(survey_ids) == 0:
+        return "1 = 0"
+    # Start a new range at each gap between two consecutive ids
+    range_start = np.flatnonzero(np.diff(survey_ids) != 1) + 1
+    listRanges = []
+    for first_id, last_id in zip(survey_ids[np.r_[0, range_start]], survey_ids[np.r_[range_start - 1, -1]]):
+        if first_id == last_id:
+            listRanges.append("{} = {}".format(strSurveyColumn, first_id))
+        else:
+            listRanges.append("{} BETWEEN {} AND {}".format(strSurveyColumn, first_id, last_id))
+    return "(" + " OR ".join(listRanges) + ")"
+
+
+def compile_AggregateQuery(survey_structure_df):
+    """
+    This function takes as input the survey structure dataframe created with the "get_db_struct()" function.
+    It emits an alternative version of the final query which scans the "Answer" table once, grouped by user and survey,
+    with one "MAX(CASE WHEN ...)" conditional aggregate per question instead of one correlated subquery per cell.
+    The membership of the questions which are only in some of the surveys is read from the "SurveyStructure" table,
+    pivoted once into one flag per question and joined to the groups, so that the length of the query depends on the
+    number of questions only (and not on the number of surveys, unlike lists of survey ids per question).
+    The result has the same semantics as the UNION query of "compile_FinalQuery()":
+    - -1 when a question of the survey has not been answered by the user,
+    - NULL when the question is not in the survey.
+    It is a pure function: it returns the final query as a string and does not write anything to disk.
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    listAnswersQueryPart = []
+    listFlagsQueryPart = []
+    listColumnsQueryPart = []
+    for question_pos, question_id in enumerate(list_QID):
+        in_survey = membership[:, question_pos].astype(bool)
+        # The question is in none of the surveys: the column is NULL for every row
+        if not in_survey.any():
+            listColumnsQueryPart.append("NULL AS ANS_Q{}".format(question_id))
+            continue
+        listAnswersQueryPart.append(
+            "COALESCE(MAX(CASE WHEN a.QuestionId = {0} THEN a.Answer_Value END), -1) AS ANS_Q{0}".format(question_id))
+        # The question is in all the surveys: the answer (or -1) is returned for every row
+        if in_survey.all():
+            listColumnsQueryPart.append("g.ANS_Q{0} AS ANS_Q{0}".format(question_id))
+        # Otherwise, only return the answer for the surveys whose structure contains the question
+        else:
+            listFlagsQueryPart.append(
+                ", MAX(CASE WHEN ss.QuestionId = {0} THEN 1 ELSE 0 END) AS IN_Q{0}".format(question_id))
+            listColumnsQueryPart.append("CASE WHEN f.IN_Q{0} = 1 THEN g.ANS_Q{0} END AS ANS_Q{0}".format(question_id))
+    # Like the UNION query, only keep the users of the "User" table and the surveys of the survey structure
+    return "SELECT g.UserId, g.SurveyId" + "".join(", " + strColumn for strColumn in listColumnsQueryPart) \
+           + " FROM (SELECT a.UserId, a.SurveyId" + "".join(", " + strAnswer for strAnswer in listAnswersQueryPart) \
+           + " FROM Answer as a INNER JOIN [User] as u ON u.UserId = a.UserId" \
+           + " WHERE " + compile_SurveyFilter(list_SID) + " GROUP BY a.UserId, a.SurveyId) as g" \
+           + " INNER JOIN (SELECT s.SurveyId" + "".join(listFlagsQueryPart) \
+           + " FROM Survey as s LEFT JOIN SurveyStructure as ss ON ss.SurveyId = s.SurveyId GROUP BY s.SurveyId) as f" \
+           + " ON f.SurveyId = g.SurveyId"
+
+
+# Compilation modes of the final query and the text files where each of them is saved:
+# - "union": the replica of dbo.fn_GetAllSurveyDataSQL, one UNION block per survey with correlated subqueries
+# - "aggregate": a single scan of the "Answer" table with conditional aggregates
+QUERY_COMPILERS = {"union": compile_FinalQuery, "aggregate": compile_AggregateQuery}
+
+
+QUERY_FILES = {"union": "saved_query.txt", "aggregate": "saved_query_aggregate.txt"}
+
+
+@timed_stage("set_FinalQuery")
+def set_FinalQuery(survey_structure_df, query_mode="union", preview=False):
+    """
+    This function takes as inputs the survey structure dataframe created with the "get_db_struct()" function,
+    the compilation mode of the query (one of the keys of "QUERY_COMPILERS") and whether to print the compiled query.
+    It compiles the final query and saves it in the text file of this mode ("saved_query.txt" for the "union" mode).
+    """
+    # Save the compiled final query in the text file associated with the compilation mode
+    write_query(QUERY_COMPILERS[query_mode](survey_structure_df), QUERY_FILES[query_mode], preview)
+
+
+@timed_stage("set_FinalQuery")
+def set_FinalQuery_legacy(survey_structure_df):
+    """
+    This function takes as input the survey structure dataframe created with the "get_db_struct()" function.
+    It uses the previously defined functions to loop over the structure of the survey and then outputs the final query.
+    It returns the final query saved in the "saved_query.txt" file.
+    It is the original nested-loop version of "set_FinalQuery()", kept as a reference implementation.
+    """
+    # Initialize the variables to be used in the function
+    # Create two lists of unique IDs for the questions and the surveys thanks to the returned variable of the function "get_db_struct()"
+    list_QID = survey_structure_df["QuestionId"].unique()
+    list_SID = survey_structure_df["SurveyId"].unique()
+    # Create two variables which stores the value of the maximum idea in order to avoid placing a comma after the last items
+    maxQID = np.max(list_QID)
+    maxSID = np.max(list_SID)
+    # Initialize the "strFinalQuery" variable as an empty string
+    strFinalQuery = ""
+    # Open the main loop to iterate over all the surveys thanks to their ids
+    for survey_id in list_SID:
+        # Initialize the "strIntermQuery" variable as an intermediate empty string
+        strIntermQuery = ""
+        # Open the inner loop to iterate over all the questions thanks to their ids
+        for question_id in list_QID:
+            # Integrate the loop variables "survey_id" and "question_id" into a new dataframe created from the "survey_structure_df"
+            sub_df = survey_structure_df[
+                (survey_structure_df["SurveyId"] == survey_id) & (survey_structure_df["QuestionId"] == question_id)]
+            # Use ".iloc" indexing method to select rows and columns by number in the dataframe "survey_structure_df":
+            # Select the last column "QuestionInSurvey" from the survey structure dataframe previously updated and return all the values (survey and questions ids) associated
+            currentInSurvey_id = sub_df.iloc[:, -1].values
+            # Update the "strIntermQuery" by adding the pieces of queries created from the "set_strColumnsQueryPart()" function
+            strIntermQuery += set_strColumnsQueryPart(question_id, currentInSurvey_id)
+            # Place a comma between column statements along question ids, except for the last one
+            if question_id < maxQID:
+                strIntermQuery += ", "
+        strFinalQuery += set_strCurrentUnionQueryBlock(survey_id, strIntermQuery)
+        # Place a "UNION" statement between column statements along survey ids, except for the last one
+        if survey_id < maxSID:
+            strFinalQuery += " UNION "
+    # Save the freshly concatenated final query in a text file as "saved_query.txt"
+    write_query(strFinalQuery)
+
+
+# Default maximum length (in characters) of the statements sent by the batched extraction
+MAX_STATEMENT_LENGTH = 4000000
+
+
+def get_survey_lengths(survey_structure_df, query_mode="union"):
+    """
+    This function takes as inputs the survey structure dataframe created with the "get_db_struct()" function and the
+    compilation mode of the final query (one of the keys of "QUERY_COMPILERS").
+    It computes from the membership matrix, without compiling the query of each survey, the length that each survey
+    adds to the final query of a batch of surveys, and the length of the part of this query which all the surveys share:
+    - "union": the UNION block of the survey and its " UNION " keyword (see "compile_FinalQuery()"), nothing is shared,
+    - "aggregate": at most a " OR a.SurveyId = <id>" condition in the survey filter (see "compile_SurveyFilter()"),
+      the rest of the query only depending on the questions (its length for all the surveys bounds the one of a batch).
+    It returns the survey ids (in survey order), the length added by each survey and the shared length.
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    survey_order = np.argsort(list_SID, kind="stable")
+    list_SID, membership = list_SID[survey_order], membership[survey_order].astype(np.int64)
+    survey_id_lengths = np.array([len(str(survey_id)) for survey_id in list_SID], dtype=np.int64)
+    if query_mode == "aggregate":
+        # The filter of a batch replaces the one of all the surveys in the query compiled for the whole structure
+        shared_length = len(compile_AggregateQuery(survey_structure_df)) - len(compile_SurveyFilter(list_SID))
+        return list_SID, survey_id_lengths + len(" OR a.SurveyId = "), shared_length
+    # Length of the column statements of each question when it is in the survey (without the survey id) or not
+    answer_lengths = np.array([len("COALESCE((SELECT a.Answer_Value FROM Answer as a WHERE a.UserId = u.UserId "
+                                   + "AND a.SurveyId =  AND a.QuestionId = {0}), -1) AS ANS_Q{0}".format(q))
+                               for q in list_QID], dtype=np.int64)
+    null_lengths = np.array([len("NULL AS ANS_Q{}".format(q)) for q in list_QID], dtype=np.int64)
+    # The column statements are joined with ", " and the answer ones hold the survey id
+    columns_lengths = membership @ (answer_lengths - null_lengths) + null_lengths.sum() \
+        + membership.sum(axis=1) * survey_id_lengths + 2 * max(len(list_QID) - 1, 0)
+    # The UNION block holds the survey id twice, and is followed by " UNION " (except for the last one)
+    strUnionQueryBlock = "SELECT UserId,  as SurveyId,  FROM [User] as u WHERE EXISTS (SELECT * FROM Answer as a " \
+                         + "WHERE u.UserId = a.UserId AND a.SurveyId = )"
+    return list_SID, columns_lengths + 2 * survey_id_lengths + len(strUnionQueryBlock) + len(" UNION "), 0
+
+
+def split_survey_batches(survey_structure_df, max_statement_length=MAX_STATEMENT_LENGTH, min_batches=1,
+                         query_mode="union"):
+    """
+    This function takes as inputs the survey structure dataframe created with the "get_db_struct()" function,
+    the maximum length of a statement, the minimum number of batches wanted (e.g. to keep several workers busy) and the
+    compilation mode of the final query of the batches.
+    It groups consecutive surveys into batches whose final query (measured with "get_survey_lengths()") stays under the
+    maximum length, and under the total length divided by "min_batches". A survey whose query alone is too long gets
+    its own batch.
+    It returns the list of the batches, each one being the list of its survey ids, in survey order.
+    """
+    list_SID, survey_lengths, shared_length = get_survey_lengths(survey_structure_df, query_mode)
+    batch_length = -(-int(survey_lengths.sum()) // max(min_batches, 1))
+    if shared_length >= max_statement_length:
+        # Smaller batches would not shorten the query: only split the surveys between the workers
+        print("[WARNING] The {} query of a batch is longer than {} characters whatever its surveys.".format(
+            query_mode, max_statement_length))
+    else:
+        batch_length = min(max_statement_length - shared_length, batch_length)
+    batches = []
+    current_batch, current_length = [], 0
+    for survey_id, length in zip(list_SID.tolist(), survey_lengths.tolist()):
+        if current_batch and current_length + length > batch_length:
+            batches.append(current_batch)
+            current_batch, current_length = [], 0
+        current_batch.append(survey_id)
+        current_length += length
+    if current_batch:
+        batches.append(current_batch)
+    return batches
@@ -0,0 +1,218 @@
+"""
+Structure of the surveys: which questions are in which survey, and its fingerprints.
+"""
+import hashlib
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from .metrics import record, timed_stage
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 2. Replicate the algorithm of the dbo.fn_GetAllSurveyDataSQL stored function.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def cursor_query(currentSurveyId):
+    """
+    This function takes as input the current survey id and include it as a string into the "currentQuestionCursor" query.
+    It returns the complete query string in the "query_currentQuestionCursor" variable.
+    """
+    query_currentQuestionCursor = "SELECT * FROM (SELECT SurveyId, QuestionId, 1 as InSurvey FROM SurveyStructure " \
+                                  + "WHERE SurveyId =" + str(currentSurveyId) + " UNION SELECT " + str(
+        currentSurveyId) + " as SurveyId, " \
+                                  + "Q.QuestionId, 0 as InSurvey FROM Question as Q WHERE NOT EXISTS(SELECT * FROM SurveyStructure as S " \
+                                  + "WHERE S.SurveyId = " + str(
+        currentSurveyId) + " AND S.QuestionId = Q.QuestionId)) as t " \
+                                  + "ORDER BY QuestionId"
+    return query_currentQuestionCursor
+
+
+@timed_stage("get_db_struct")
+def get_db_struct(current_sql_cnxn):
+    """
+    This function takes as input the current connection variable outputted by the "db_connection()" function.
+    It fetches the "Survey", "Question" and "SurveyStructure" tables in three bulk queries on a single cursor and builds
+    the structure of the survey as a dataframe with vectorized numpy operations (one row per survey and question).
+    It returns the same dataframe as "get_db_struct_legacy()" without running one query per survey.
+    """
+    # Create a single cursor and make sure it is closed even if one of the queries fails
+    with closing(current_sql_cnxn.cursor()) as structCursor:
+        # Fetch the ordered survey ids, the ordered question ids and the (survey, question) pairs of the survey structure
+        structCursor.execute("SELECT SurveyId FROM Survey ORDER BY SurveyId")
+        survey_ids = np.array([row[0] for row in structCursor.fetchall()], dtype=np.int64)
+        structCursor.execute("SELECT QuestionId FROM Question ORDER BY QuestionId")
+        question_ids = np.array([row[0] for row in structCursor.fetchall()], dtype=np.int64)
+        structCursor.execute("SELECT SurveyId, QuestionId FROM SurveyStructure")
+        struct_pairs = np.array([tuple(row) for row in structCursor.fetchall()], dtype=np.int64).reshape(-1, 2)
+    record(queries=3, rows=len(survey_ids) + len(question_ids) + len(struct_pairs))
+    # Build the cartesian product survey x question in the same order as the legacy cursors (by survey, then by question)
+    all_surveys = np.repeat(survey_ids, len(question_ids))
+    all_questions = np.tile(question_ids, len(survey_ids))
+    # Flag the (survey, question) pairs found in the survey structure: each pair is encoded as a single integer key
+    # "SurveyId * key_base + QuestionId" so that one "np.isin()" call performs the membership test of all the pairs
+    key_base = int(max(question_ids.max(initial=0), struct_pairs[:, 1].max(initial=0))) + 1
+    in_survey = np.isin(all_surveys * key_base + all_questions,
+                        struct_pairs[:, 0] * key_base + struct_pairs[:, 1]).astype(np.int64)
+    # Store the structure of the survey data in a dataframe with the same header as the legacy version
+    db_struct = pd.DataFrame({"SurveyId": all_surveys, "QuestionId": all_questions, "QuestionInSurvey": in_survey})
+    return db_struct
+
+
+@timed_stage("get_db_struct")
+def get_db_struct_legacy(current_sql_cnxn):
+    """
+    This function takes as input the current connection variable outputted by the "db_connection()" function.
+    It creates the main connection cursor variable and fetch on all surveys to build and output the structure of the survey as a dataframe.
+    It is the original cursor-based version of "get_db_struct()" (one query per survey), kept as a reference implementation.
+    """
+    # Create and open the main cursor
+    surveyCursor1 = current_sql_cnxn.cursor()
+    # Order the surveys by survey IDs
+    surveyCursor1.execute("SELECT SurveyId FROM Survey ORDER BY SurveyId")
+    record(queries=1)
+    # Initialization of the output data: multiple rows/lists to be stacked along 3 columns
+    FRes = [0, 0, 0]
+    # Loop over the survey ids
+    for currentSurveyId in surveyCursor1.fetchall():
+        # Initialize the "surveyId" variable as being the first element of the list "currentSurveyId"
+        surveyId = currentSurveyId[0]
+        # Create and open a second cursor
+        surveyCursor2 = current_sql_cnxn.cursor()
+        # Execute the "query_currentQuestionCursor" query with the survey ids
+        surveyCursor2.execute(cursor_query(surveyId))
+        currentQuestions = surveyCursor2.fetchall()
+        record(queries=1, rows=1 + len(currentQuestions))
+        # For each survey id, loop over "currentSurveyIdInQuestion", "currentQuestionId" and "currentInSurvey" to get the corresponding data
+        for currentSurveyIdInQuestion, currentQuestionId, currentInSurvey in currentQuestions:
+            # Create a row/list of data by survey id
+            IRes = np.array([currentSurveyIdInQuestion, currentQuestionId, currentInSurvey])
+            # Stack all the previously obtained rows/lists all together to get a matrix (list of lists)
+            FRes = np.vstack((FRes, IRes))
+        # Close the inner cursor once the questions of the current survey have been fetched
+        surveyCursor2.close()
+    # Close the main cursor
+    surveyCursor1.close()
+    # Store the structure of the survey data "FRes" in a dataframe, without the first column of ids (with respect to the template)
+    db_struct = pd.DataFrame(FRes[1:, :])
+    # Add a header (names for each column of stacked data) and return the structure of the database "db_struct"
+    db_struct.columns = ["SurveyId", "QuestionId", "QuestionInSurvey"]
+    return db_struct
+
+
+def get_membership_matrix(survey_structure_df):
+    """
+    This function takes as input the survey structure dataframe created with the "get_db_struct()" function.
+    It pivots the "QuestionInSurvey" column once into a dense survey x question matrix of 0/1 flags.
+    It returns the survey ids, the question ids (both in order of appearance) and the membership matrix.
+    """
+    # Keep the ids in their order of appearance, like the "unique()" calls of the legacy query builder
+    list_SID = pd.unique(survey_structure_df["SurveyId"])
+    list_QID = pd.unique(survey_structure_df["QuestionId"])
+    # Locate each row of the structure in the matrix with an index lookup instead of a boolean mask per cell
+    row_pos = pd.Index(list_SID).get_indexer(survey_structure_df["SurveyId"])
+    col_pos = pd.Index(list_QID).get_indexer(survey_structure_df["QuestionId"])
+    # Fill the matrix: the (survey, question) pairs missing from the structure are considered out of the survey
+    membership = np.zeros((len(list_SID), len(list_QID)), dtype=np.int8)
+    membership[row_pos, col_pos] = (survey_structure_df["QuestionInSurvey"].to_numpy() != 0)
+    return list_SID, list_QID, membership
+
+
+def fetch_surveys_without_respondents(sql_conn):
+    """
+    This function takes as input the connection to the database.
+    It fetches in a single query the ids of the surveys without any respondent, i.e. without any answer of a user of
+    the "User" table: the final query returns no row for them.
+    It returns them as a list of integers (usually empty).
+    """
+    with closing(sql_conn.cursor()) as surveyCursor:
+        surveyCursor.execute("SELECT s.SurveyId FROM Survey as s WHERE NOT EXISTS (SELECT * FROM Answer as a "
+                             + "INNER JOIN [User] as u ON u.UserId = a.UserId WHERE a.SurveyId = s.SurveyId)")
+        rows = surveyCursor.fetchall()
+    record(queries=1, rows=len(rows))
+    return [int(row[0]) for row in rows]
+
+
+def get_answer_dtypes(survey_structure_df, surveys_without_respondents=()):
+    """
+    This function takes as inputs the survey structure dataframe created with the "get_db_struct()" function and
+    optionally the ids of the surveys without any respondent returned by "fetch_surveys_without_respondents()".
+    It returns the dtypes of the columns of the pivoted survey data, as "pd.read_sql()" infers them from the full result
+    of the final query: the answer columns of the questions present in every survey with respondents never contain NULL
+    and are integers, the other answer columns contain NULL and are floats.
+    Without them, the dtypes only depend on the structure: a question missing from a survey without any respondent is
+    then typed as a float column, whereas "pd.read_sql()" reads it as integers.
+    """
+    list_SID, list_QID, membership = get_membership_matrix(survey_structure_df)
+    # The surveys without respondents have no row in the result, so their missing questions do not produce any NULL
+    has_rows = ~np.isin(list_SID, np.asarray(surveys_without_respondents, dtype=np.int64))
+    answer_dtypes = {"UserId": "int64", "SurveyId": "int64"}
+    for question_id, in_all_surveys in zip(list_QID, membership[has_rows].all(axis=0).tolist()):
+        answer_dtypes["ANS_Q{}".format(question_id)] = "int64" if in_all_surveys and has_rows.any() else "float64"
+    return answer_dtypes
+
+
+def hash_survey_structure(survey_structure_df):
+    """
+    This function takes as input the survey structure dataframe created with the "get_db_struct()" function.
+    It returns a compact content hash (SHA-256) of the structure, computed on its values cast to 64-bit integers
+    so that it does not depend on the dtypes of the dataframe.
+    """
+    structure_values = survey_structure_df[["SurveyId", "QuestionId", "QuestionInSurvey"]].to_numpy(dtype=np.int64)
+    return hashlib.sha256(np.ascontiguousarray(structure_values).tobytes()).hexdigest()
+
+
+# Prime modulus of the row hashes of the checksums: below 2^31 so that the product of two hashes fits in a BIGINT, and
+# with "CHECKSUM_MODULUS % 3 == 2" so that cubing is a bijection modulo it
+CHECKSUM_MODULUS = 2147483579
+# Multiplier combining the columns of a row into its hash
+CHECKSUM_MULTIPLIER = 1000003
+
+
+def get_checksum_sql(columns):
+    """
+    This function takes as input a list of SQL integer expressions: the columns of a row of a table.
+    It returns a SQL aggregate summing a non-linear hash of each row, portable across SQL Server and SQLite: the columns
+    are combined modulo a prime, and the combination is cubed modulo the same prime. Unlike a weighted sum of the columns,
+    the changes of several rows do not cancel each other out.
+    """
+    row_hash = "CAST({} AS BIGINT) % {}".format(columns[0], CHECKSUM_MODULUS)
+    for column in columns[1:]:
+        row_hash = "(({}) * {} + {}) % {}".format(row_hash, CHECKSUM_MULTIPLIER, column, CHECKSUM_MODULUS)
+    return "SUM(({0}) * ({0}) % {1} * ({0}) % {1})".format(row_hash, CHECKSUM_MODULUS)
+
+
+# Scalar subqueries of the fingerprint of the survey structure: row counts and checksums of the keys of the tables
+# (see "get_checksum_sql()")
+STRUCTURE_FINGERPRINT_PARTS = [
+    "(SELECT COUNT(*) FROM Survey)",
+    "(SELECT " + get_checksum_sql(["SurveyId"]) + " FROM Survey)",
+    "(SELECT COUNT(*) FROM Question)",
+    "(SELECT " + get_checksum_sql(["QuestionId"]) + " FROM Question)",
+    "(SELECT COUNT(*) FROM SurveyStructure)",
+    "(SELECT " + get_checksum_sql(["SurveyId", "QuestionId"]) + " FROM SurveyStructure)",
+]
+
+
+def fetch_fingerprint(sql_conn, fingerprint_parts):
+    """
+    This function takes as inputs the connection to the database and a list of scalar subqueries.
+    It runs all the subqueries in a single "SELECT" statement.
+    It returns their values as a list of integers (or None for the aggregates of empty tables).
+    """
+    with closing(sql_conn.cursor()) as fingerprintCursor:
+        fingerprintCursor.execute("SELECT " + ", ".join(fingerprint_parts))
+        record(queries=1, rows=1)
+        return [None if value is None else int(value) for value in fingerprintCursor.fetchone()]
+
+
+def fetch_structure_fingerprint(sql_conn):
+    """
+    This function takes as input the connection to the database.
+    It computes in a single cheap query a fingerprint of the tables the survey structure is built from ("Survey",
+    "Question" and "SurveyStructure"): their row counts and checksums of their keys.
+    It returns the fingerprint as a list of integers (or None for the checksums of empty tables).
+    """
+    return fetch_fingerprint(sql_conn, STRUCTURE_FINGERPRINT_PARTS)
@@ -0,0 +1,105 @@
+"""
+Watch mode: a long-running change poller which replicates the dbo.trg_refreshSurveyView trigger and keeps the export of
+the survey data fresh.
+"""
+import time
+
+from .connection import close_conn, db_connection, get_connection_owner
+from .pipeline import run_pipeline
+from .structure import STRUCTURE_FINGERPRINT_PARTS, fetch_fingerprint, get_checksum_sql
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Instruction:
+# 3. Replicate the algorithm of the trigger dbo.trg_refreshSurveyView for creating/altering the view vw_AllSurveyData
+#    whenever applicable.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# Scalar subqueries of the fingerprint of the survey data: row counts, maximum keys and checksums of the answers and of the
+# users, whose rows are joined by the final query (see "get_checksum_sql()")
+DATA_FINGERPRINT_PARTS = [
+    "(SELECT COUNT(*) FROM Answer)",
+    "(SELECT MAX(UserId) FROM Answer)",
+    "(SELECT " + get_checksum_sql(["SurveyId", "UserId", "QuestionId", "COALESCE(Answer_Value, -1)"]) + " FROM Answer)",
+    "(SELECT COUNT(*) FROM [User])",
+    "(SELECT " + get_checksum_sql(["UserId"]) + " FROM [User])",
+]
+
+
+def fetch_change_fingerprint(sql_conn):
+    """
+    This function takes as input the connection to the database.
+    It computes in a single query the fingerprint of the survey structure (see "fetch_structure_fingerprint()") followed
+    by the fingerprint of the survey data (see "DATA_FINGERPRINT_PARTS").
+    It returns the fingerprint as a list of integers: its first "len(STRUCTURE_FINGERPRINT_PARTS)" values only change
+    with the survey structure.
+    """
+    return fetch_fingerprint(sql_conn, STRUCTURE_FINGERPRINT_PARTS + DATA_FINGERPRINT_PARTS)
+
+
+def run_watch(sql_driver, my_server, my_database, interval=60, debounce=5, push_view=False, max_refreshes=None,
+              **pipeline_kwargs):
+    """
+    This function takes as inputs the name of the SQL driver, the name of the user's server and the name of the database,
+    the number of seconds between two polls, the number of seconds without any change after which a burst of changes is
+    considered finished, whether to create or alter the "vw_AllSurveyData" view on the server when the survey structure
+    changes, the maximum number of refreshes (None to run until interrupted) and the other options of "run_pipeline()".
+    It runs the pipeline once, then polls the database with a single fingerprint query every "interval" seconds
+    (see "fetch_change_fingerprint()") and runs the pipeline again when the fingerprint changes:
+    - the successive changes of a burst are merged: the refresh waits until the fingerprint has not changed for "debounce"
+      seconds (or for at most "interval" seconds, so that a continuous flow of changes is still refreshed),
+    - the final query is only compiled again when the survey structure has changed (see "check_view()"), and the view is
+      only pushed to the server in this case,
+    - a failed poll or refresh is reported and retried at the next poll.
+    It returns the number of refreshes once "max_refreshes" is reached or the watch is interrupted (Ctrl+C).
+    """
+    backend = pipeline_kwargs.get("backend", "pyodbc")
+    # Open the connection manager of the database: the polls borrow one of its pooled connections
+    watch_cnxn = db_connection(sql_driver, my_server, my_database, backend)
+    manager = get_connection_owner(watch_cnxn)
+    close_conn(watch_cnxn)
+    nb_structure_parts = len(STRUCTURE_FINGERPRINT_PARTS)
+
+    def poll():
+        with manager.acquire() as poll_cnxn:
+            return fetch_change_fingerprint(poll_cnxn)
+
+    print("[WATCH] Polling the database for changes every {} s (Ctrl+C to stop).\n".format(interval))
+    # Fingerprint of the data of the last successful refresh
+    last_fingerprint = None
+    nb_refreshes = 0
+    try:
+        while True:
+            try:
+                fingerprint = poll()
+                if fingerprint == last_fingerprint:
+                    time.sleep(interval)
+                    continue
+                if last_fingerprint is not None:
+                    print("[WATCH] A change has been detected, waiting for the end of the burst of changes...\n")
+                    deadline = time.monotonic() + max(interval, debounce)
+                    while time.monotonic() < deadline:
+                        time.sleep(debounce)
+                        settled_fingerprint = poll()
+                        if settled_fingerprint == fingerprint:
+                            break
+                        fingerprint = settled_fingerprint
+                structure_changed = (last_fingerprint is None
+                                     or fingerprint[:nb_structure_parts] != last_fingerprint[:nb_structure_parts])
+                run_pipeline(sql_driver, my_server, my_database, push_view=push_view and structure_changed,
+                             **pipeline_kwargs)
+            # A failed poll or refresh (a database error, possibly wrapped by pandas, or a failed connection, for which
+            # "db_connection()" exits the program) must not stop the watch: only Ctrl+C does
+            except (Exception, SystemExit) as err:
+                print("[WARNING] The refresh has failed and will be retried at the next poll:\n{}\n".format(err))
+                time.sleep(interval)
+                continue
+            last_fingerprint = fingerprint
+            nb_refreshes += 1
+            print("[WATCH] Refresh #{} done.\n".format(nb_refreshes))
+            if max_refreshes is not None and nb_refreshes >= max_refreshes:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("[WATCH] The watch has been stopped.\n")
+    return nb_refreshes